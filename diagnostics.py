@@ -0,0 +1,1977 @@
+"""Diagnostic subsystems behind simple-server.py.
+
+Wire formats, DNS and disk checks, the fleet view, backup inspection,
+query-plan checks, traffic capture and replay, the metrics archive and
+static file lookup. They live in an importable module, unlike the
+simple-server.py script, so their compiled bytecode is cached in
+__pycache__ and not rebuilt on every start.
+"""
+import os
+import sys
+import json
+import socket
+import struct
+import datetime
+import glob
+import http.client
+import mmap
+import logging
+import re
+import tempfile
+import threading
+import time
+import zlib
+import ipaddress
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+logger = logging.getLogger('diagnostic-server')
+
+# Persistent metrics archive for post-mortems. Disabled unless ARCHIVE_DIR
+# is set; samples are taken every ARCHIVE_INTERVAL seconds.
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', 10))
+# Records per segment file before rotating (8640 = one day at 10s)
+ARCHIVE_SEGMENT_RECORDS = int(os.environ.get('ARCHIVE_SEGMENT_RECORDS', 8640))
+# Sealed segments older than this are downsampled into ARCHIVE_COMPACT_BUCKET buckets
+ARCHIVE_COMPACT_AFTER = float(os.environ.get('ARCHIVE_COMPACT_AFTER_HOURS', 24)) * 3600
+ARCHIVE_COMPACT_BUCKET = int(os.environ.get('ARCHIVE_COMPACT_BUCKET', 300))
+# Segments entirely older than this are deleted
+ARCHIVE_RETENTION = float(os.environ.get('ARCHIVE_RETENTION_DAYS', 30)) * 86400
+
+# Segment layout: a 64 byte header followed by fixed-size records, each
+# ending in a CRC32 of its body. Preallocated space is zero-filled, which
+# never passes the CRC, so the first invalid record marks the end of data
+# and a record torn by a crash is simply overwritten on restart.
+ARCHIVE_MAGIC = b'DIAGARC1'
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct('<8sHHIdI')  # magic, version, record size, capacity, created, bucket seconds
+ARCHIVE_HEADER_SIZE = 64
+ARCHIVE_RECORD = struct.Struct('<dIdfffQQQQIIffIBB2x')
+ARCHIVE_CHECKSUM = struct.Struct('<I')
+ARCHIVE_RECORD_SIZE = ARCHIVE_RECORD.size + ARCHIVE_CHECKSUM.size
+ARCHIVE_FIELDS = (
+    'timestamp', 'pid', 'uptime_seconds', 'load_1m', 'load_5m', 'load_15m',
+    'mem_total_kb', 'mem_available_kb', 'requests_total', 'errors_total',
+    'requests', 'errors', 'latency_avg_ms', 'latency_max_ms', 'inflight',
+    'db_status', 'state'
+)
+# Enumerations stored as single bytes
+ARCHIVE_DB_STATUSES = ('unknown', 'ok', 'error', 'not_configured', 'module_install_failed')
+ARCHIVE_STATES = ('serving', 'draining')
+
+# /api/disk: /proc/diskstats rates are computed against the previous sample.
+# When there is no usable previous sample, two samples are taken this many
+# seconds apart (?window= can ask for up to DISK_MAX_WINDOW).
+DISK_SAMPLE_WINDOW = float(os.environ.get('DISK_SAMPLE_WINDOW', 0.5))
+DISK_MAX_WINDOW = 5.0
+# A previous sample older than this is too stale to describe "now"
+DISK_MAX_SAMPLE_AGE = 300.0
+# /proc/diskstats reports sizes in 512 byte sectors regardless of the device
+DISK_SECTOR_SIZE = 512
+# Previous diskstats sample: (monotonic time, {device: counters})
+DISKSTATS_PREVIOUS = {'sample': None}
+DISKSTATS_LOCK = threading.Lock()
+
+# Active probe (?probe=1): write, fsync and read back small blocks in a
+# scratch file. Each limit caps the probe's cost; whichever is hit first ends it.
+DISK_PROBE_DIR = os.environ.get('DISK_PROBE_DIR', tempfile.gettempdir())
+DISK_PROBE_BLOCK_SIZE = 4096
+DISK_PROBE_MAX_OPS = int(os.environ.get('DISK_PROBE_MAX_OPS', 32))
+DISK_PROBE_MAX_BYTES = 1024 * 1024
+DISK_PROBE_TIME_BUDGET = float(os.environ.get('DISK_PROBE_TIME_BUDGET', 2.0))
+# Probes closer together than this return the previous result
+DISK_PROBE_MIN_INTERVAL = float(os.environ.get('DISK_PROBE_MIN_INTERVAL', 10.0))
+# Held while a probe runs; a second caller never waits for it
+DISK_PROBE_LOCK = threading.Lock()
+DISK_PROBE_LAST = {'result': None, 'finished': None}
+
+# Hostname/FQDN are cached for DNS_CACHE_TTL seconds and refreshed in the
+# background, so a slow or broken reverse DNS never stalls a request
+DNS_CACHE_TTL = float(os.environ.get('DNS_CACHE_TTL', 300))
+# /api/dns: extra names to check (comma separated) besides the DATABASE_URL
+# host and this machine's hostname, and how long a lookup may take
+DNS_CHECK_NAMES = os.environ.get('DNS_CHECK_NAMES', '')
+DNS_TIMEOUT = float(os.environ.get('DNS_TIMEOUT', 2.0))
+DNS_MAX_SAMPLES = 10
+# Resolver calls cannot be interrupted, so they run here; a hung lookup
+# ties up one worker rather than a request handler
+DNS_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='dns')
+# The FQDN refresh gets its own worker so hung /api/dns lookups can't starve it
+HOST_IDENTITY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='host-identity')
+
+HOST_IDENTITY = {'hostname': None, 'fqdn': None, 'resolved_at': None, 'refreshing': False, 'lookup_ms': None}
+HOST_IDENTITY_LOCK = threading.Lock()
+
+# (name, record type) -> running lookup statistics for /api/dns
+DNS_STATS = {}
+DNS_STATS_LOCK = threading.Lock()
+DNS_RECENT_LATENCIES = 100
+
+# Traffic capture: with CAPTURE_FILE set every request except raw routes
+# (/livez) is appended as one compact JSON line [time, method, path, query,
+# headers] for `replay`.
+# The file rotates at CAPTURE_MAX_BYTES keeping CAPTURE_BACKUPS old files.
+CAPTURE_FILE = os.environ.get('CAPTURE_FILE')
+CAPTURE_MAX_BYTES = int(os.environ.get('CAPTURE_MAX_BYTES', 10 * 1024 * 1024))
+CAPTURE_BACKUPS = int(os.environ.get('CAPTURE_BACKUPS', 5))
+# Request headers that change how a response is produced
+CAPTURE_HEADERS = ('Accept', 'Accept-Encoding', 'User-Agent', 'Range', 'If-Range',
+                   'If-None-Match', 'X-Forwarded-Proto', 'X-Forwarded-For')
+capture_logger = logging.getLogger('diagnostic-server.capture')
+capture_logger.propagate = False
+
+# Peer diagnostic servers aggregated by /api/fleet: base URLs from
+# FLEET_PEERS (comma separated) and/or FLEET_PEERS_FILE (one per line)
+FLEET_PEERS = os.environ.get('FLEET_PEERS', '')
+FLEET_PEERS_FILE = os.environ.get('FLEET_PEERS_FILE')
+FLEET_PEER_TIMEOUT = float(os.environ.get('FLEET_PEER_TIMEOUT', 2.0))
+# Peer results are reused for this long so dashboard refreshes don't fan out every time
+FLEET_CACHE_TTL = float(os.environ.get('FLEET_CACHE_TTL', 5.0))
+# Idle connections kept per peer for reuse
+FLEET_POOL_SIZE = 4
+
+# Only the fields the fleet view needs are requested from peers
+FLEET_HEALTH_PATH = '/api/health?format=compact&fields=status,hostname,database.status,server.state,server.uptime_seconds'
+
+# peer -> (fetched at monotonic time, result dict)
+FLEET_CACHE = {}
+FLEET_CACHE_LOCK = threading.Lock()
+# (scheme, host, port) -> idle http.client connections
+FLEET_CONNECTION_POOL = {}
+FLEET_POOL_LOCK = threading.Lock()
+# FLEET_PEERS_FILE is re-read only when its mtime changes
+FLEET_FILE_STATE = {'mtime': None, 'peers': []}
+
+FLEET_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='fleet-peer')
+
+# pg_dump backups inspected by /api/backups and the inspect-backup command:
+# directories matching BACKUP_GLOB under BACKUP_ROOT (the repo root by default)
+BACKUP_ROOT = os.environ.get('BACKUP_ROOT', os.path.dirname(os.path.abspath(__file__)))
+BACKUP_GLOB = os.environ.get('BACKUP_GLOB', 'neon_backup_*')
+# Preferred dump when a backup directory holds several
+BACKUP_FILE_PREFERENCE = ('full_backup.sql', 'data_backup.sql', 'schema_backup.sql')
+
+# (path, size, mtime_ns) -> inspection result; dumps never change in place
+BACKUP_INSPECTION_CACHE = {}
+BACKUP_INSPECTION_LOCK = threading.Lock()
+
+# Query-plan regression checks (/api/query-plans and the query-plans command).
+# QUERY_PLAN_CATALOG names a JSON file {name: {"sql": ..., "params": {...}}}
+# that replaces the built-in catalog; plan fingerprints are kept in
+# QUERY_PLAN_BASELINE so regressions survive restarts. The default lives in
+# ARCHIVE_DIR, or next to this script, never in the temp directory.
+QUERY_PLAN_CATALOG_FILE = os.environ.get('QUERY_PLAN_CATALOG')
+QUERY_PLAN_BASELINE_FILE = os.environ.get('QUERY_PLAN_BASELINE', os.path.join(
+    ARCHIVE_DIR or os.path.dirname(os.path.abspath(__file__)), 'diagnostic-query-plans.json'))
+QUERY_PLAN_TIMEOUT_MS = int(os.environ.get('QUERY_PLAN_TIMEOUT_MS', 5000))
+# Re-check every QUERY_PLAN_INTERVAL seconds in the background (0 = on demand only)
+QUERY_PLAN_INTERVAL = float(os.environ.get('QUERY_PLAN_INTERVAL', 0))
+# A plan regressed when its estimated cost grew by this factor...
+QUERY_PLAN_COST_FACTOR = float(os.environ.get('QUERY_PLAN_COST_FACTOR', 2.0))
+# ...and by at least this many cost units (tiny plans fluctuate a lot)
+QUERY_PLAN_MIN_COST_DELTA = 50.0
+INDEX_SCAN_NODES = ('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+
+# The app's hottest read paths (see server/storage.ts)
+DEFAULT_QUERY_PLAN_CATALOG = {
+    'locations_by_city': {
+        'sql': "SELECT id, title, price FROM locations WHERE city = %(city)s AND status = 'approved' "
+               "ORDER BY id DESC LIMIT 24",
+        'params': {'city': 'Los Angeles'}
+    },
+    'bookings_by_location_dates': {
+        'sql': "SELECT id, client_id, start_date, end_date, status FROM bookings "
+               "WHERE location_id = %(location_id)s AND start_date < %(until)s AND end_date > %(since)s "
+               "ORDER BY start_date",
+        'params': {'location_id': 1, 'since': '2025-01-01', 'until': '2026-01-01'}
+    },
+    'reviews_by_location': {
+        'sql': "SELECT rating, comment, created_at FROM reviews WHERE location_id = %(location_id)s "
+               "ORDER BY created_at DESC LIMIT 20",
+        'params': {'location_id': 1}
+    },
+    'conversation_messages': {
+        'sql': "SELECT id, sender_id, message, sent_at FROM messages WHERE conversation_id = %(conversation_id)s "
+               "ORDER BY sent_at",
+        'params': {'conversation_id': 1}
+    },
+    'saved_locations_by_user': {
+        'sql': "SELECT location_id, folder_id, created_at FROM saved_locations WHERE user_id = %(user_id)s "
+               "ORDER BY created_at DESC",
+        'params': {'user_id': 1}
+    },
+    'active_spotlights': {
+        'sql': "SELECT s.id, s.location_id, l.title FROM spotlight_locations s "
+               "JOIN locations l ON l.id = s.location_id "
+               "WHERE s.active AND s.start_date <= now() AND s.end_date >= now()",
+        'params': {}
+    },
+}
+
+# One run at a time; the newest result is served between runs
+QUERY_PLAN_LOCK = threading.Lock()
+QUERY_PLAN_LAST = {'result': None, 'finished': None}
+
+# Wire formats available to JSON endpoints through ?format= or Accept.
+# Maps format name -> Content-Type
+RESPONSE_FORMATS = {
+    'json': 'application/json',
+    'compact': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'msgpack': 'application/msgpack',
+}
+
+# Accept media types and the format each one selects. Compact JSON is
+# requested with an indent parameter: "Accept: application/json; indent=0"
+ACCEPT_FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+}
+
+# Static file mode: when STATIC_DIR is set (e.g. dist/public from the Vite
+# build) paths that are not diagnostic routes are served from it
+STATIC_DIR = os.path.realpath(os.environ['STATIC_DIR']) if os.environ.get('STATIC_DIR') else None
+
+# How long file metadata is trusted before the file is stat'ed again, and
+# how many paths (including misses) the metadata cache remembers
+STATIC_METADATA_TTL = float(os.environ.get('STATIC_METADATA_TTL', 5.0))
+STATIC_METADATA_MAX_ENTRIES = 4096
+
+# url path -> file metadata dict (or None for a miss), least recently used first
+STATIC_METADATA_CACHE = OrderedDict()
+STATIC_METADATA_LOCK = threading.Lock()
+
+# Precompressed siblings in order of preference: Content-Encoding -> suffix
+STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Content-hashed build output such as assets/index-BxK9z2Qa.js never changes
+# under the same name, so it can be cached forever. Only Vite's layout
+# matches: under assets/ at the static root, an 8 character hash with a digit
+# or an inner capital, so hand-named files like hero-Background.png don't
+HASHED_ASSET_PATTERN = re.compile(
+    r'assets/(?:[^/]+/)*[^/]*-(?=.{0,7}[0-9]|.[A-Za-z0-9_-]{0,6}[A-Z])[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')
+
+# Extra types registered when the mimetypes database is first loaded
+STATIC_EXTRA_TYPES = (('text/javascript', '.js'), ('text/javascript', '.mjs'), ('image/webp', '.webp'))
+
+def load_fleet_peers():
+    """Return the configured peer base URLs, de-duplicated in order"""
+    peers = [peer.strip() for peer in FLEET_PEERS.split(',') if peer.strip()]
+
+    if FLEET_PEERS_FILE:
+        try:
+            mtime = os.stat(FLEET_PEERS_FILE).st_mtime_ns
+            if mtime != FLEET_FILE_STATE['mtime']:
+                with open(FLEET_PEERS_FILE, 'r') as f:
+                    FLEET_FILE_STATE['peers'] = [
+                        line.split('#', 1)[0].strip() for line in f
+                        if line.split('#', 1)[0].strip()
+                    ]
+                FLEET_FILE_STATE['mtime'] = mtime
+            peers.extend(FLEET_FILE_STATE['peers'])
+        except OSError as e:
+            logger.warning(f"Unable to read FLEET_PEERS_FILE {FLEET_PEERS_FILE}: {str(e)}")
+
+    normalized = []
+    for peer in peers:
+        if '://' not in peer:
+            peer = f"http://{peer}"
+        peer = peer.rstrip('/')
+        if peer not in normalized:
+            normalized.append(peer)
+    return normalized
+
+def get_peer_health(peer, refresh=False):
+    """Peer health, served from FLEET_CACHE while it is fresh"""
+    now = time.monotonic()
+    if not refresh:
+        with FLEET_CACHE_LOCK:
+            cached = FLEET_CACHE.get(peer)
+        if cached and now - cached[0] < FLEET_CACHE_TTL:
+            return dict(cached[1], cached=True, age_seconds=round(now - cached[0], 2))
+
+    result = fetch_peer_health(peer)
+    with FLEET_CACHE_LOCK:
+        FLEET_CACHE[peer] = (time.monotonic(), result)
+    return dict(result, cached=False, age_seconds=0.0)
+
+def fetch_peer_health(peer):
+    """Query one peer's /api/health over a pooled connection"""
+    parsed = urlparse(peer)
+    pool_key = (parsed.scheme, parsed.hostname, parsed.port)
+    result = {'peer': peer, 'healthy': False, 'status': 'unreachable', 'latency_ms': None}
+
+    conn, reused = checkout_peer_connection(pool_key)
+    try:
+        started = time.monotonic()
+        try:
+            conn.request('GET', parsed.path + FLEET_HEALTH_PATH, headers={'Accept': 'application/json'})
+            response = conn.getresponse()
+        except ConnectionError:
+            if not reused:
+                raise
+            # The peer closed the idle pooled connection (restart, keep-alive
+            # timeout); retry once on a fresh one before calling it unreachable
+            conn.close()
+            conn, _ = checkout_peer_connection(pool_key, fresh=True)
+            started = time.monotonic()
+            conn.request('GET', parsed.path + FLEET_HEALTH_PATH, headers={'Accept': 'application/json'})
+            response = conn.getresponse()
+        body = response.read()
+        result['latency_ms'] = round((time.monotonic() - started) * 1000, 2)
+        result['http_status'] = response.status
+        if not response.will_close:
+            checkin_peer_connection(pool_key, conn)
+            conn = None
+
+        health = json.loads(body.decode('utf-8'))
+        result['status'] = health.get('status', 'unknown')
+        result['healthy'] = response.status == 200 and result['status'] == 'ok'
+        result['hostname'] = health.get('hostname')
+        result['database_status'] = (health.get('database') or {}).get('status')
+        result['server_state'] = (health.get('server') or {}).get('state')
+        result['uptime_seconds'] = (health.get('server') or {}).get('uptime_seconds')
+    except socket.timeout:
+        result['status'] = 'timeout'
+        result['error'] = f"No response within {FLEET_PEER_TIMEOUT}s"
+    except ValueError as e:
+        result['status'] = 'invalid_response'
+        result['error'] = f"Response was not JSON: {str(e)}"
+    except (OSError, http.client.HTTPException) as e:
+        result['error'] = str(e)
+    finally:
+        if conn is not None:
+            conn.close()
+    return result
+
+def checkout_peer_connection(pool_key, fresh=False):
+    """Take an idle connection for a peer from the pool, or open a new one.
+
+    Returns (connection, reused); fresh skips the pool.
+    """
+    if not fresh:
+        with FLEET_POOL_LOCK:
+            idle = FLEET_CONNECTION_POOL.get(pool_key)
+            if idle:
+                return idle.pop(), True
+    scheme, host, port = pool_key
+    if scheme == 'https':
+        return http.client.HTTPSConnection(host, port, timeout=FLEET_PEER_TIMEOUT), False
+    return http.client.HTTPConnection(host, port, timeout=FLEET_PEER_TIMEOUT), False
+
+def checkin_peer_connection(pool_key, conn):
+    """Return a kept-alive connection to the pool"""
+    with FLEET_POOL_LOCK:
+        idle = FLEET_CONNECTION_POOL.setdefault(pool_key, [])
+        if len(idle) < FLEET_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+def summarize_fleet(results):
+    """Merge per-peer results into counts, database disagreements and latency outliers"""
+    import statistics
+    healthy = [result['peer'] for result in results if result['healthy']]
+    unhealthy = [result['peer'] for result in results if not result['healthy']]
+
+    database_statuses = {}
+    for result in results:
+        if result.get('database_status'):
+            database_statuses.setdefault(result['database_status'], []).append(result['peer'])
+
+    # Outliers are measured against the median using the median absolute
+    # deviation, which a single very slow peer cannot drag upwards
+    latencies = [result['latency_ms'] for result in results if result['latency_ms'] is not None]
+    latency = {'median_ms': None, 'outlier_threshold_ms': None, 'outliers': []}
+    if latencies:
+        median = statistics.median(latencies)
+        latency['median_ms'] = round(median, 2)
+        if len(latencies) >= 3:
+            mad = statistics.median(abs(value - median) for value in latencies)
+            threshold = median + max(3 * 1.4826 * mad, 50.0)
+            latency['outlier_threshold_ms'] = round(threshold, 2)
+            latency['outliers'] = [
+                {'peer': result['peer'], 'latency_ms': result['latency_ms']}
+                for result in results
+                if result['latency_ms'] is not None and result['latency_ms'] > threshold
+            ]
+
+    return {
+        'summary': {
+            'total': len(results),
+            'healthy': len(healthy),
+            'unhealthy': len(unhealthy),
+            'unhealthy_peers': unhealthy
+        },
+        'database': {
+            'disagreement': len(database_statuses) > 1,
+            'statuses': database_statuses
+        },
+        'latency': latency
+    }
+
+def find_backup_dirs():
+    """Backup directories under BACKUP_ROOT, oldest first"""
+    paths = [path for path in glob.glob(os.path.join(BACKUP_ROOT, BACKUP_GLOB)) if os.path.isdir(path)]
+    return sorted(paths, key=lambda path: os.path.basename(path))
+
+def inspect_backup_dir(path):
+    """Inspect every .sql dump in a backup directory"""
+    dumps = {}
+    for dump_path in sorted(glob.glob(os.path.join(path, '*.sql'))):
+        try:
+            dumps[os.path.basename(dump_path)] = inspect_pg_dump_cached(dump_path)
+        except OSError as e:
+            dumps[os.path.basename(dump_path)] = {'path': dump_path, 'error': str(e)}
+
+    primary = None
+    for name in BACKUP_FILE_PREFERENCE + tuple(dumps):
+        dump = dumps.get(name)
+        if dump and 'error' not in dump and dump['size_bytes'] > 0:
+            primary = dump
+            break
+
+    return {
+        'name': os.path.basename(path),
+        'path': path,
+        'files': dumps,
+        'primary_dump': primary
+    }
+
+def inspect_pg_dump_cached(path):
+    """inspect_pg_dump, reusing the result while the file is unchanged"""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with BACKUP_INSPECTION_LOCK:
+        cached = BACKUP_INSPECTION_CACHE.get(key)
+    if cached is None:
+        cached = inspect_pg_dump(path)
+        with BACKUP_INSPECTION_LOCK:
+            BACKUP_INSPECTION_CACHE[key] = cached
+    return cached
+
+# pg_dump table-of-contents comment preceding every object:
+# "-- Name: users; Type: TABLE; Schema: public; Owner: neondb_owner"
+PG_DUMP_TOC_PATTERN = re.compile(rb'^-- (?:Data for )?Name: (.+?); Type: ([A-Z ]+?); Schema: ([^;]*);')
+PG_DUMP_COPY_PATTERN = re.compile(rb'^COPY ([^\s(]+)')
+PG_DUMP_INSERT_PATTERN = re.compile(rb'^INSERT INTO ([^\s(]+)')
+PG_DUMP_TIMESTAMP_PATTERN = re.compile(rb'^-- (Started|Completed) on (.+)$')
+PG_DUMP_VERSION_PATTERN = re.compile(rb'^-- Dumped (from database|by pg_dump) version (.+)$')
+# pg_dump writes this last; without it the dump was cut short
+PG_DUMP_TRAILER = b'-- PostgreSQL database dump complete'
+
+def inspect_pg_dump(path):
+    """Single streaming pass over a plain-format pg_dump file.
+
+    Memory use is bounded by the longest line: the file is hashed and parsed
+    as it is read, COPY rows are counted and checksummed per table, and the
+    TOC comments give the schema object inventory.
+    """
+    import hashlib
+    file_hash = hashlib.sha256()
+    inventory = {}
+    tables = {}
+    header = {}
+    size = 0
+    copy_table = None
+    copy_hash = None
+    trailer_seen = False
+
+    with open(path, 'rb') as f:
+        for line in f:
+            size += len(line)
+            file_hash.update(line)
+
+            if copy_table is not None:
+                # Inside a COPY block every line is a row until the \. terminator
+                if line.rstrip(b'\r\n') == b'\\.':
+                    tables[copy_table]['checksum'] = copy_hash.hexdigest()
+                    copy_table = None
+                else:
+                    tables[copy_table]['rows'] += 1
+                    copy_hash.update(line)
+                continue
+
+            if not line.startswith((b'--', b'COPY', b'INSERT')):
+                continue
+
+            if line.rstrip(b'\r\n') == PG_DUMP_TRAILER:
+                trailer_seen = True
+                continue
+
+            toc = PG_DUMP_TOC_PATTERN.match(line)
+            if toc:
+                object_type = toc.group(2).decode('utf-8')
+                inventory[object_type] = inventory.get(object_type, 0) + 1
+                if object_type == 'TABLE':
+                    name = f"{toc.group(3).decode('utf-8')}.{toc.group(1).decode('utf-8')}"
+                    tables.setdefault(name, {'rows': None, 'checksum': None})
+                continue
+
+            copy = PG_DUMP_COPY_PATTERN.match(line)
+            if copy:
+                copy_table = copy.group(1).decode('utf-8').replace('"', '')
+                table = tables.setdefault(copy_table, {'rows': None, 'checksum': None})
+                table['rows'] = table['rows'] or 0
+                copy_hash = hashlib.sha256()
+                continue
+
+            insert = PG_DUMP_INSERT_PATTERN.match(line)
+            if insert:
+                # --inserts dumps: one statement per row
+                name = insert.group(1).decode('utf-8').replace('"', '')
+                table = tables.setdefault(name, {'rows': None, 'checksum': None})
+                table['rows'] = (table['rows'] or 0) + 1
+                continue
+
+            for pattern in (PG_DUMP_TIMESTAMP_PATTERN, PG_DUMP_VERSION_PATTERN):
+                match = pattern.match(line.rstrip(b'\r\n'))
+                if match:
+                    header[match.group(1).decode('utf-8')] = match.group(2).decode('utf-8').strip()
+
+    dump_timestamp, timestamp_source = find_dump_timestamp(path, header)
+    has_data = any(table['rows'] is not None for table in tables.values())
+
+    return {
+        'path': path,
+        'size_bytes': size,
+        'sha256': file_hash.hexdigest(),
+        'server_version': header.get('from database'),
+        'pg_dump_version': header.get('by pg_dump'),
+        'dump_timestamp': dump_timestamp,
+        'timestamp_source': timestamp_source,
+        'complete': trailer_seen and copy_table is None,
+        'contains_data': has_data,
+        'object_inventory': dict(sorted(inventory.items())),
+        'total_rows': sum(table['rows'] or 0 for table in tables.values()),
+        'tables': dict(sorted(tables.items()))
+    }
+
+def find_dump_timestamp(path, header):
+    """Best available timestamp for when a dump was taken, and where it came from"""
+    # pg_dump --verbose records the start time in the dump itself
+    if 'Started' in header:
+        return header['Started'], 'dump_header'
+
+    # backup-current-neon.sh writes BACKUP_INFO.txt and names directories
+    # neon_backup_YYYYMMDD_HHMMSS
+    backup_dir = os.path.dirname(path)
+    try:
+        with open(os.path.join(backup_dir, 'BACKUP_INFO.txt'), 'r') as f:
+            for line in f:
+                if line.startswith('Date:'):
+                    return line.split(':', 1)[1].strip(), 'backup_info'
+    except OSError:
+        pass
+
+    match = re.search(r'(\d{8}_\d{6})', os.path.basename(backup_dir))
+    if match:
+        return datetime.datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').isoformat(), 'directory_name'
+
+    return datetime.datetime.fromtimestamp(os.stat(path).st_mtime).isoformat(), 'file_mtime'
+
+def compare_dump_to_live(dump):
+    """Compare a dump's per-table row counts with live estimates from pg_class"""
+    comparison = {
+        'dump': dump['path'],
+        'dump_timestamp': dump['dump_timestamp'],
+        'backup_age': backup_age(dump),
+    }
+    if 'DATABASE_URL' not in os.environ:
+        return dict(comparison, status='not_configured', message='DATABASE_URL not set')
+    if not dump['contains_data']:
+        return dict(comparison, status='no_data', message='Dump has no table data to compare')
+
+    try:
+        live = fetch_live_row_estimates()
+    except ImportError:
+        return dict(comparison, status='unavailable', message='psycopg2 is not installed')
+    except Exception as e:
+        logger.error(f"Error reading live row estimates: {str(e)}")
+        return dict(comparison, status='error', message=str(e))
+
+    tables = {}
+    for name, table in dump['tables'].items():
+        if table['rows'] is None:
+            continue
+        estimate = live.get(name)
+        entry = {'backup_rows': table['rows'], 'live_estimate': estimate}
+        if estimate is not None:
+            entry['delta'] = estimate - table['rows']
+            entry['delta_percent'] = round(100.0 * entry['delta'] / table['rows'], 1) if table['rows'] else None
+        tables[name] = entry
+
+    changed = [name for name, entry in tables.items() if entry.get('delta')]
+    return dict(
+        comparison,
+        status='ok',
+        # reltuples is an estimate maintained by VACUUM/ANALYZE, not an exact count
+        estimate_source='pg_class.reltuples (pg_stat_user_tables.n_live_tup when never analyzed)',
+        tables_changed=changed,
+        only_in_backup=sorted(name for name in tables if tables[name]['live_estimate'] is None),
+        only_in_live=sorted(set(live) - set(dump['tables'])),
+        backup_total_rows=sum(entry['backup_rows'] for entry in tables.values()),
+        live_total_estimate=sum(live.values()),
+        tables=tables
+    )
+
+def backup_age(dump):
+    """Human readable age of a dump, when its timestamp can be parsed"""
+    timestamp = dump['dump_timestamp']
+    for fmt in (None, '%a %b %d %H:%M:%S %Z %Y', '%a %b %d %H:%M:%S %Y'):
+        try:
+            if fmt is None:
+                taken = datetime.datetime.fromisoformat(timestamp)
+            else:
+                # Drop the zone name (e.g. PDT) that strptime cannot resolve
+                parts = timestamp.split()
+                taken = datetime.datetime.strptime(' '.join(parts[:4] + parts[-1:]), '%a %b %d %H:%M:%S %Y')
+            if taken.tzinfo is not None:
+                taken = taken.astimezone().replace(tzinfo=None)
+            return format_uptime((datetime.datetime.now() - taken).total_seconds())
+        except (ValueError, IndexError):
+            continue
+    return None
+
+def fetch_live_row_estimates():
+    """Live row estimates for every user table, keyed by schema.table"""
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=5,
+                            options='-c statement_timeout=5000')
+    try:
+        cursor = conn.cursor()
+        # reltuples is -1 for tables that were never vacuumed or analyzed
+        cursor.execute("""
+            SELECT n.nspname, c.relname,
+                   CASE WHEN c.reltuples < 0 THEN COALESCE(s.n_live_tup, 0)
+                        ELSE c.reltuples::bigint END
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE c.relkind IN ('r', 'p')
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%'
+        """)
+        return {f"{schema}.{table}": int(rows) for schema, table, rows in cursor.fetchall()}
+    finally:
+        conn.close()
+
+def inspect_backup_cli(args):
+    """inspect-backup command: print backup inspection (and drift) as JSON"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='simple-server.py inspect-backup',
+        description='Stream-parse pg_dump backups and report row counts, checksums and schema inventory.'
+    )
+    parser.add_argument('paths', nargs='*',
+                        help=f'dump files or backup directories (default: {BACKUP_GLOB} under {BACKUP_ROOT})')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare the last dump given against live row estimates (needs DATABASE_URL)')
+    options = parser.parse_args(args)
+
+    results = []
+    for path in options.paths or find_backup_dirs():
+        if os.path.isdir(path):
+            results.append(inspect_backup_dir(path))
+        else:
+            results.append(inspect_pg_dump(path))
+
+    output = {'backups': results}
+    if options.compare:
+        dumps = [result.get('primary_dump') if 'files' in result else result for result in results]
+        dumps = [dump for dump in dumps if dump and dump.get('contains_data')]
+        output['drift'] = compare_dump_to_live(dumps[-1]) if dumps else {'status': 'no_backup'}
+
+    print(json.dumps(output, indent=2))
+    return 0
+
+def load_query_catalog(path=None):
+    """The query catalog from a JSON file, or the built-in one"""
+    path = path or QUERY_PLAN_CATALOG_FILE
+    if not path:
+        return DEFAULT_QUERY_PLAN_CATALOG
+    with open(path, 'r') as f:
+        catalog = json.load(f)
+    for name, entry in catalog.items():
+        if not isinstance(entry, dict) or 'sql' not in entry:
+            raise ValueError(f"Catalog entry '{name}' has no sql")
+    return catalog
+
+def load_plan_baselines(path):
+    """Stored plan summaries keyed by query name"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable plan baseline {path}: {str(e)}")
+        return {}
+
+def save_plan_baselines(path, baselines):
+    """Write baselines atomically so a crash never leaves half a file"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+def summarize_plan(explain):
+    """Fingerprint and headline numbers from EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)"""
+    import hashlib
+    root = explain[0]
+    scans = {}
+
+    def shape(node):
+        label = node['Node Type']
+        if 'Relation Name' in node:
+            label += f" on {node['Relation Name']}"
+            scans.setdefault(node['Relation Name'], set()).add(node['Node Type'])
+        if 'Index Name' in node:
+            label += f" using {node['Index Name']}"
+        children = [shape(child) for child in node.get('Plans', [])]
+        return f"{label}({', '.join(children)})" if children else label
+
+    plan = root['Plan']
+    # Costs and row counts are left out so the fingerprint only changes
+    # when the planner picks a different strategy
+    plan_shape = shape(plan)
+    return {
+        'fingerprint': hashlib.sha1(plan_shape.encode('utf-8')).hexdigest()[:16],
+        'shape': plan_shape,
+        'scans': {relation: sorted(nodes) for relation, nodes in sorted(scans.items())},
+        'total_cost': plan['Total Cost'],
+        'rows': plan.get('Actual Rows'),
+        'planning_ms': root.get('Planning Time'),
+        'execution_ms': root.get('Execution Time'),
+        'shared_hit_blocks': plan.get('Shared Hit Blocks'),
+        'shared_read_blocks': plan.get('Shared Read Blocks'),
+    }
+
+def compare_plan(current, baseline):
+    """Findings for a plan against its baseline; seq_scan and cost_jump are regressions"""
+    findings = []
+    for relation, nodes in current['scans'].items():
+        before = baseline['scans'].get(relation, [])
+        if ('Seq Scan' in nodes and not any(node in INDEX_SCAN_NODES for node in nodes)
+                and any(node in INDEX_SCAN_NODES for node in before)):
+            findings.append({'type': 'seq_scan', 'relation': relation, 'was': before})
+    cost, baseline_cost = current['total_cost'], baseline['total_cost']
+    if cost > baseline_cost * QUERY_PLAN_COST_FACTOR and cost - baseline_cost >= QUERY_PLAN_MIN_COST_DELTA:
+        findings.append({'type': 'cost_jump', 'baseline_cost': baseline_cost, 'cost': cost,
+                         'factor': round(cost / baseline_cost, 1) if baseline_cost else None})
+    if current['fingerprint'] != baseline['fingerprint']:
+        findings.append({'type': 'plan_changed', 'baseline_shape': baseline['shape']})
+    return findings
+
+def run_query_plan_checks(names=None, update_baseline=False, catalog=None,
+                          baseline_path=None, timeout_ms=None):
+    """EXPLAIN ANALYZE each catalog query and compare it with its baseline.
+
+    The first plan seen for a query (or for a changed SQL text) becomes its
+    baseline. Queries run in read-only transactions under statement_timeout.
+    """
+    import hashlib
+    catalog = catalog or load_query_catalog()
+    baseline_path = baseline_path or QUERY_PLAN_BASELINE_FILE
+    timeout_ms = timeout_ms or QUERY_PLAN_TIMEOUT_MS
+    selected = {name: catalog[name] for name in names} if names else catalog
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'statement_timeout_ms': timeout_ms,
+        'baseline_file': baseline_path,
+    }
+    if 'DATABASE_URL' not in os.environ:
+        return dict(result, status='not_configured', message='DATABASE_URL not set')
+    try:
+        import psycopg2
+    except ImportError:
+        return dict(result, status='unavailable', message='psycopg2 is not installed')
+
+    with QUERY_PLAN_LOCK:
+        baselines = load_plan_baselines(baseline_path)
+        queries = {}
+        try:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=5,
+                                    options=f'-c statement_timeout={timeout_ms}')
+        except Exception as e:
+            logger.error(f"Query plans: cannot connect: {str(e)}")
+            return dict(result, status='error', message=str(e))
+        try:
+            # EXPLAIN ANALYZE executes the statement; read-only keeps a
+            # mistaken catalog entry from changing anything
+            conn.set_session(readonly=True, autocommit=True)
+            cursor = conn.cursor()
+            for name, entry in selected.items():
+                sql_hash = hashlib.sha1(entry['sql'].encode('utf-8')).hexdigest()[:16]
+                try:
+                    cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + entry['sql'], entry.get('params') or {})
+                    summary = summarize_plan(cursor.fetchone()[0])
+                except psycopg2.Error as e:
+                    # 57014 is query_canceled, raised when statement_timeout fires
+                    status = 'timeout' if e.pgcode == '57014' else 'error'
+                    queries[name] = {'status': status, 'message': str(e).strip()}
+                    continue
+
+                baseline = baselines.get(name)
+                if update_baseline or baseline is None or baseline.get('sql_hash') != sql_hash:
+                    baselines[name] = dict(summary, sql_hash=sql_hash, recorded=result['timestamp'])
+                    queries[name] = dict(summary, status='baseline_recorded')
+                    continue
+
+                findings = compare_plan(summary, baseline)
+                if any(finding['type'] != 'plan_changed' for finding in findings):
+                    status = 'regressed'
+                    logger.warning(f"Query plan regression in {name}: "
+                                   f"{', '.join(finding['type'] for finding in findings)}")
+                else:
+                    status = 'changed' if findings else 'ok'
+                queries[name] = dict(summary, status=status, findings=findings,
+                                     baseline_fingerprint=baseline['fingerprint'],
+                                     baseline_recorded=baseline.get('recorded'))
+        finally:
+            conn.close()
+        save_plan_baselines(baseline_path, baselines)
+
+        result.update(
+            status=('regressed' if any(q['status'] == 'regressed' for q in queries.values()) else
+                    'error' if any(q['status'] in ('error', 'timeout') for q in queries.values()) else 'ok'),
+            regressions=[name for name, q in queries.items() if q['status'] == 'regressed'],
+            queries=queries
+        )
+        if not names:
+            QUERY_PLAN_LAST['result'] = result
+            QUERY_PLAN_LAST['finished'] = time.monotonic()
+    return result
+
+def run_query_plan_scheduler(stop_event):
+    """Background loop re-checking the catalog every QUERY_PLAN_INTERVAL seconds"""
+    while not stop_event.wait(QUERY_PLAN_INTERVAL):
+        try:
+            run_query_plan_checks()
+        except Exception as e:
+            logger.error(f"Query plans: scheduled check failed: {str(e)}")
+
+# Dump lines a scratch database cannot replay: psql's \restrict guard (unknown
+# to psql before 17.6), pg_dump 17's transaction_timeout (unknown to servers
+# before 17) and the ownership/ACL statements naming Neon roles, i.e. what
+# pg_restore --no-owner --no-acl would leave out
+SEED_SKIP_PATTERN = re.compile(rb'^(?:\\(?:un)?restrict |SET transaction_timeout |ALTER .+ OWNER TO |GRANT |REVOKE '
+                               rb'|ALTER DEFAULT PRIVILEGES )')
+
+def seed_dump_lines(path):
+    """Lines of a pg_dump file without the statements SEED_SKIP_PATTERN drops"""
+    in_copy = False
+    with open(path, 'rb') as f:
+        for line in f:
+            if in_copy:
+                in_copy = line.rstrip(b'\r\n') != b'\\.'
+            elif PG_DUMP_COPY_PATTERN.match(line):
+                in_copy = True
+            elif SEED_SKIP_PATTERN.match(line):
+                continue
+            yield line
+
+def find_seed_dump():
+    """schema_backup.sql of the newest backup that has a non-empty one"""
+    for path in reversed(find_backup_dirs()):
+        dump_path = os.path.join(path, 'schema_backup.sql')
+        if os.path.isfile(dump_path) and os.path.getsize(dump_path) > 0:
+            return dump_path
+    return None
+
+def seed_db_cli(args):
+    """seed-db command: load a backup into DATABASE_URL for the query-plans command"""
+    import argparse
+    import subprocess
+    parser = argparse.ArgumentParser(
+        prog='simple-server.py seed-db',
+        description='Load a pg_dump backup into an empty database through psql, skipping the \\restrict '
+                    'guard and the Neon role ownership and grants (like pg_restore --no-owner --no-acl).'
+    )
+    parser.add_argument('dump', nargs='?',
+                        help=f'dump file (default: the newest non-empty schema_backup.sql under {BACKUP_ROOT})')
+    parser.add_argument('--print', dest='print_sql', action='store_true',
+                        help='write the filtered SQL to stdout instead of running psql')
+    options = parser.parse_args(args)
+
+    dump_path = options.dump or find_seed_dump()
+    if not dump_path:
+        parser.error(f"no non-empty schema_backup.sql in {BACKUP_GLOB} under {BACKUP_ROOT}")
+    if options.print_sql:
+        sys.stdout.buffer.writelines(seed_dump_lines(dump_path))
+        return 0
+
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url:
+        parser.error('DATABASE_URL is not set')
+    try:
+        psql = subprocess.Popen(['psql', db_url, '--no-psqlrc', '--quiet', '--output', os.devnull,
+                                 '--single-transaction', '-v', 'ON_ERROR_STOP=1', '-f', '-'],
+                                stdin=subprocess.PIPE)
+    except FileNotFoundError:
+        parser.error('psql not found; pipe the --print output into another PostgreSQL client')
+    try:
+        psql.stdin.writelines(seed_dump_lines(dump_path))
+        psql.stdin.close()
+    except BrokenPipeError:
+        # psql stopped at the first error and has already reported it
+        pass
+    return psql.wait()
+
+def query_plans_cli(args):
+    """query-plans command: check the query catalog and exit 1 on regressions"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='simple-server.py query-plans',
+        description='EXPLAIN ANALYZE the hot query catalog and flag plan regressions. '
+                    'To try it locally, point DATABASE_URL at an empty database and load the '
+                    'newest schema backup into it with "simple-server.py seed-db".'
+    )
+    parser.add_argument('--query', action='append', default=[], help='only check this query (repeatable)')
+    parser.add_argument('--catalog', default=QUERY_PLAN_CATALOG_FILE,
+                        help='JSON catalog replacing the built-in queries')
+    parser.add_argument('--baseline', default=QUERY_PLAN_BASELINE_FILE, help='plan baseline file')
+    parser.add_argument('--update-baseline', action='store_true', help='accept the current plans as the baseline')
+    parser.add_argument('--timeout-ms', type=int, default=QUERY_PLAN_TIMEOUT_MS, help='statement_timeout per query')
+    parser.add_argument('--list', action='store_true', help='print the catalog and exit')
+    options = parser.parse_args(args)
+
+    catalog = load_query_catalog(options.catalog)
+    if options.list:
+        print(json.dumps(catalog, indent=2))
+        return 0
+    unknown = [name for name in options.query if name not in catalog]
+    if unknown:
+        parser.error(f"unknown query: {', '.join(unknown)}")
+
+    result = run_query_plan_checks(options.query or None, options.update_baseline, catalog,
+                                   options.baseline, options.timeout_ms)
+    print(json.dumps(result, indent=2))
+    return 0 if result['status'] == 'ok' else 1
+
+def enable_traffic_capture(path):
+    """Route capture records to a size-capped, rotating file"""
+    import logging.handlers
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=CAPTURE_MAX_BYTES,
+                                                   backupCount=CAPTURE_BACKUPS)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    capture_logger.addHandler(handler)
+    capture_logger.setLevel(logging.INFO)
+
+def capture_files(paths):
+    """Expand a capture base path into its rotated files, oldest first"""
+    files = []
+    for path in paths:
+        if os.path.exists(f"{path}.1"):
+            # Only path.N; compressed or otherwise renamed copies are not ours
+            rotated = [name for name in glob.glob(f"{glob.escape(path)}.[0-9]*")
+                       if name[len(path) + 1:].isdigit()]
+            files.extend(sorted(rotated, key=lambda name: int(name[len(path) + 1:]), reverse=True))
+        files.append(path)
+    return files
+
+def read_capture(paths):
+    """Yield (time, method, path, query, headers) from capture files in order"""
+    for path in capture_files(paths):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    timestamp, method, request_path, query, headers = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash or rotation
+                    continue
+                yield timestamp, method, request_path, query, headers
+
+def replay_cli(args):
+    """replay command: re-issue captured traffic and report the latency distribution"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='simple-server.py replay',
+        description='Replay a capture file against a server, preserving (or scaling) inter-arrival times.'
+    )
+    parser.add_argument('captures', nargs='+', help='capture files (rotated siblings are included automatically)')
+    parser.add_argument('--target', default='http://127.0.0.1:5000', help='base URL to send requests to')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time scale: 2 replays twice as fast, 0 sends as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=16, help='maximum requests in flight')
+    parser.add_argument('--limit', type=int, default=None, help='stop after this many requests')
+    parser.add_argument('--timeout', type=float, default=10.0, help='per-request timeout in seconds')
+    options = parser.parse_args(args)
+
+    target = urlparse(options.target if '://' in options.target else f"http://{options.target}")
+    connections = threading.local()
+    results = []
+    results_lock = threading.Lock()
+
+    def send(scheduled, method, path, query, headers):
+        lag = time.monotonic() - scheduled
+        conn = getattr(connections, 'conn', None)
+        if conn is None:
+            connection_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+            conn = connections.conn = connection_class(target.hostname, target.port, timeout=options.timeout)
+        started = time.perf_counter()
+        status = None
+        try:
+            conn.request(method, target.path.rstrip('/') + path + (f'?{query}' if query else ''), headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            if response.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException) as e:
+            status = type(e).__name__
+            conn.close()
+        elapsed = time.perf_counter() - started
+        with results_lock:
+            results.append((path, status, elapsed, lag))
+
+    executor = ThreadPoolExecutor(max_workers=options.concurrency, thread_name_prefix='replay')
+    first_timestamp = None
+    replay_start = time.monotonic()
+    sent = 0
+    for timestamp, method, path, query, headers in read_capture(options.captures):
+        if options.limit is not None and sent >= options.limit:
+            break
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        scheduled = replay_start
+        if options.speed > 0:
+            scheduled += (timestamp - first_timestamp) / options.speed
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        executor.submit(send, scheduled, method, path, query, headers)
+        sent += 1
+    executor.shutdown(wait=True)
+    duration = time.monotonic() - replay_start
+
+    statuses = {}
+    by_path = {}
+    for path, status, elapsed, lag in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        by_path.setdefault(path, []).append(elapsed)
+    errors = sum(1 for _, status, _, _ in results if not isinstance(status, int) or status >= 500)
+
+    report = {
+        'target': options.target,
+        'speed': options.speed,
+        'requests': len(results),
+        'errors': errors,
+        'duration_seconds': round(duration, 3),
+        'requests_per_second': round(len(results) / duration, 2) if duration else None,
+        'statuses': statuses,
+        'latency': latency_summary([elapsed for _, _, elapsed, _ in results]),
+        # How late requests left relative to the captured timing; large values
+        # mean --concurrency could not keep up with the replay rate
+        'schedule_lag': latency_summary([lag for _, _, _, lag in results]),
+        'paths': {
+            path: latency_summary(values)
+            for path, values in sorted(by_path.items(), key=lambda item: -len(item[1]))
+        }
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if errors == 0 else 1
+
+def parse_archive_time(value):
+    """Accept unix seconds or an ISO 8601 timestamp"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers (pct in 0-100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def latency_summary(seconds):
+    """p50/p90/p99/max in milliseconds for a list of durations in seconds"""
+    milliseconds = [value * 1000 for value in seconds]
+    return {
+        'count': len(milliseconds),
+        'p50_ms': round(percentile(milliseconds, 50), 3) if milliseconds else None,
+        'p90_ms': round(percentile(milliseconds, 90), 3) if milliseconds else None,
+        'p99_ms': round(percentile(milliseconds, 99), 3) if milliseconds else None,
+        'max_ms': round(max(milliseconds), 3) if milliseconds else None
+    }
+
+def get_host_identity():
+    """Cached hostname and FQDN; never waits for DNS.
+
+    A stale or missing entry schedules one background refresh and the last
+    known value (or the bare hostname) is returned meanwhile.
+    """
+    with HOST_IDENTITY_LOCK:
+        resolved_at = HOST_IDENTITY['resolved_at']
+        stale = resolved_at is None or time.monotonic() - resolved_at > DNS_CACHE_TTL
+        if stale and not HOST_IDENTITY['refreshing']:
+            HOST_IDENTITY['refreshing'] = True
+            HOST_IDENTITY_EXECUTOR.submit(refresh_host_identity)
+        hostname = HOST_IDENTITY['hostname'] or socket.gethostname()
+        return {
+            'hostname': hostname,
+            'fqdn': HOST_IDENTITY['fqdn'] or hostname,
+            'status': 'pending' if resolved_at is None else ('stale' if stale else 'resolved'),
+            'age_seconds': round(time.monotonic() - resolved_at, 1) if resolved_at is not None else None,
+            'lookup_ms': HOST_IDENTITY['lookup_ms']
+        }
+
+def refresh_host_identity():
+    """Resolve hostname and FQDN (runs on HOST_IDENTITY_EXECUTOR)"""
+    try:
+        hostname = socket.gethostname()
+        started = time.monotonic()
+        fqdn = socket.getfqdn(hostname)
+        elapsed = time.monotonic() - started
+        with HOST_IDENTITY_LOCK:
+            HOST_IDENTITY.update(hostname=hostname, fqdn=fqdn, resolved_at=time.monotonic(),
+                                 lookup_ms=round(elapsed * 1000, 2))
+        if elapsed > 1.0:
+            logger.warning(f"FQDN lookup for {hostname} took {elapsed:.1f}s")
+    except Exception as e:
+        logger.error(f"Host identity refresh failed: {str(e)}")
+    finally:
+        with HOST_IDENTITY_LOCK:
+            HOST_IDENTITY['refreshing'] = False
+
+def dns_check_names():
+    """Names /api/dns checks by default: DNS_CHECK_NAMES, the DATABASE_URL host, this host"""
+    names = [name.strip() for name in DNS_CHECK_NAMES.split(',') if name.strip()]
+    if os.environ.get('DATABASE_URL'):
+        db_host = urlparse(os.environ['DATABASE_URL']).hostname
+        if db_host:
+            names.append(db_host)
+    names.append(socket.gethostname())
+    return list(dict.fromkeys(names))
+
+def dns_record_types(name):
+    """Lookups that make sense for a name: IP literals only get a reverse lookup"""
+    try:
+        ipaddress.ip_address(name)
+        return ('PTR',)
+    except ValueError:
+        return ('A', 'AAAA', 'PTR')
+
+def timed_dns_lookup(name, record_type):
+    """One lookup, returning (result, error, elapsed seconds)"""
+    try:
+        address = name
+        if record_type == 'PTR' and dns_record_types(name) != ('PTR',):
+            # Reverse-resolve the name's first address; the forward step is not timed
+            address = socket.getaddrinfo(name, None, proto=socket.IPPROTO_TCP)[0][4][0]
+        started = time.perf_counter()
+        if record_type == 'PTR':
+            result = socket.gethostbyaddr(address)[0]
+        else:
+            family = socket.AF_INET if record_type == 'A' else socket.AF_INET6
+            infos = socket.getaddrinfo(name, None, family, proto=socket.IPPROTO_TCP)
+            result = sorted({info[4][0] for info in infos})
+        return result, None, time.perf_counter() - started
+    except (OSError, UnicodeError) as e:
+        return None, str(e), None
+
+def record_dns_result(name, record_type, result, error, elapsed, timed_out=False, queued=False):
+    """Fold one lookup into DNS_STATS; queued lookups were cancelled before they ran"""
+    with DNS_STATS_LOCK:
+        stats = DNS_STATS.setdefault((name, record_type), {
+            'latencies': deque(maxlen=DNS_RECENT_LATENCIES),
+            'lookups': 0, 'failures': 0, 'timeouts': 0, 'queued': 0,
+            'last_result': None, 'last_error': None
+        })
+        if queued:
+            stats['queued'] += 1
+            return
+        stats['lookups'] += 1
+        if timed_out:
+            stats['timeouts'] += 1
+            stats['last_error'] = error
+        elif error is not None:
+            stats['failures'] += 1
+            stats['last_error'] = error
+        else:
+            stats['latencies'].append(elapsed)
+            stats['last_result'] = result
+
+def dns_stats_summary(name, record_type):
+    """Cumulative statistics for one (name, record type)"""
+    with DNS_STATS_LOCK:
+        stats = DNS_STATS[(name, record_type)]
+        return {
+            'result': stats['last_result'],
+            'lookups': stats['lookups'],
+            'failures': stats['failures'],
+            'timeouts': stats['timeouts'],
+            'queued': stats['queued'],
+            'last_error': stats['last_error'],
+            # Percentiles over the most recent successful lookups
+            'latency': latency_summary(list(stats['latencies']))
+        }
+
+def read_diskstats():
+    """Parse /proc/diskstats into {device: counters}"""
+    devices = {}
+    with open('/proc/diskstats', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 14:
+                continue
+            devices[parts[2]] = {
+                'reads': int(parts[3]),
+                'sectors_read': int(parts[5]),
+                'read_ms': int(parts[6]),
+                'writes': int(parts[7]),
+                'sectors_written': int(parts[9]),
+                'write_ms': int(parts[10]),
+                'in_progress': int(parts[11]),
+                'io_ms': int(parts[12]),
+                'weighted_io_ms': int(parts[13])
+            }
+    return devices
+
+def disk_io_rates(window=None, show_all=False):
+    """Per-device throughput, IOPS, queue depth and utilisation from diskstats deltas"""
+    # The lock only guards DISKSTATS_PREVIOUS; sampling and the sleep happen
+    # outside it so one slow ?window= request never blocks the others
+    with DISKSTATS_LOCK:
+        previous = DISKSTATS_PREVIOUS['sample']
+    try:
+        now = time.monotonic()
+        if window is not None or previous is None or not 0.1 <= now - previous[0] <= DISK_MAX_SAMPLE_AGE:
+            # No usable previous sample: measure over a short window
+            window = min(max(DISK_SAMPLE_WINDOW if window is None else window, 0.1), DISK_MAX_WINDOW)
+            previous = (time.monotonic(), read_diskstats())
+            time.sleep(window)
+        current = (time.monotonic(), read_diskstats())
+    except OSError as e:
+        return {'error': f"Unable to read /proc/diskstats: {str(e)}"}
+    with DISKSTATS_LOCK:
+        # Concurrent requests can finish out of order; keep the newest sample
+        stored = DISKSTATS_PREVIOUS['sample']
+        if stored is None or stored[0] < current[0]:
+            DISKSTATS_PREVIOUS['sample'] = current
+
+    interval = current[0] - previous[0]
+    interval_ms = interval * 1000
+    devices = {}
+    for name, now_counters in current[1].items():
+        before = previous[1].get(name)
+        if before is None:
+            continue
+        if not show_all and (name.startswith(('loop', 'ram', 'zram')) or
+                             (now_counters['reads'] + now_counters['writes']) == 0):
+            continue
+        delta = {key: now_counters[key] - before[key] for key in now_counters}
+        devices[name] = {
+            'read_bytes_per_sec': round(delta['sectors_read'] * DISK_SECTOR_SIZE / interval, 1),
+            'write_bytes_per_sec': round(delta['sectors_written'] * DISK_SECTOR_SIZE / interval, 1),
+            'read_iops': round(delta['reads'] / interval, 2),
+            'write_iops': round(delta['writes'] / interval, 2),
+            'read_await_ms': round(delta['read_ms'] / delta['reads'], 3) if delta['reads'] else None,
+            'write_await_ms': round(delta['write_ms'] / delta['writes'], 3) if delta['writes'] else None,
+            # Time-weighted I/O divided by wall time is the average queue depth
+            'avg_queue_depth': round(delta['weighted_io_ms'] / interval_ms, 3),
+            'utilisation_percent': round(min(100.0, 100.0 * delta['io_ms'] / interval_ms), 1),
+            'in_flight': now_counters['in_progress']
+        }
+    return {'interval_seconds': round(interval, 3), 'devices': devices}
+
+def run_disk_probe():
+    """Bounded write/fsync/read latency probe; never runs concurrently with itself"""
+    if not DISK_PROBE_LOCK.acquire(blocking=False):
+        return {'status': 'busy', 'message': 'Another disk probe is running'}
+    try:
+        last = DISK_PROBE_LAST
+        if last['finished'] is not None and time.monotonic() - last['finished'] < DISK_PROBE_MIN_INTERVAL:
+            return dict(last['result'], cached=True,
+                        age_seconds=round(time.monotonic() - last['finished'], 1))
+
+        result = probe_disk_latency()
+        last['result'] = result
+        last['finished'] = time.monotonic()
+        return dict(result, cached=False, age_seconds=0.0)
+    finally:
+        DISK_PROBE_LOCK.release()
+
+def probe_disk_latency():
+    """Time block writes, fsyncs and uncached reads in a scratch file"""
+    max_ops = max(1, min(DISK_PROBE_MAX_OPS, DISK_PROBE_MAX_BYTES // DISK_PROBE_BLOCK_SIZE))
+    block = os.urandom(DISK_PROBE_BLOCK_SIZE)
+    writes, fsyncs, reads = [], [], []
+    started = time.monotonic()
+    deadline = started + DISK_PROBE_TIME_BUDGET
+    stopped_by = 'max_ops'
+
+    try:
+        fd, path = tempfile.mkstemp(prefix='.disk-probe-', dir=DISK_PROBE_DIR)
+    except OSError as e:
+        return {'status': 'error', 'error': f"Unable to create probe file in {DISK_PROBE_DIR}: {str(e)}"}
+
+    try:
+        for index in range(max_ops):
+            if time.monotonic() >= deadline:
+                stopped_by = 'time_budget'
+                break
+            t0 = time.perf_counter()
+            os.pwrite(fd, block, index * DISK_PROBE_BLOCK_SIZE)
+            t1 = time.perf_counter()
+            os.fsync(fd)
+            t2 = time.perf_counter()
+            writes.append(t1 - t0)
+            fsyncs.append(t2 - t1)
+
+        # Drop the written pages from the page cache so reads reach the device
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        for index in range(len(writes)):
+            if time.monotonic() >= deadline:
+                stopped_by = 'time_budget'
+                break
+            t0 = time.perf_counter()
+            os.pread(fd, DISK_PROBE_BLOCK_SIZE, index * DISK_PROBE_BLOCK_SIZE)
+            reads.append(time.perf_counter() - t0)
+    except OSError as e:
+        return {'status': 'error', 'error': f"Disk probe failed: {str(e)}"}
+    finally:
+        os.close(fd)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    return {
+        'status': 'ok',
+        'directory': DISK_PROBE_DIR,
+        'block_size': DISK_PROBE_BLOCK_SIZE,
+        'bytes_written': len(writes) * DISK_PROBE_BLOCK_SIZE,
+        'stopped_by': stopped_by,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 2),
+        'write': latency_summary(writes),
+        'fsync': latency_summary(fsyncs),
+        'read': latency_summary(reads)
+    }
+
+class MetricsArchive:
+    """Append-only archive of fixed-size samples in memory-mapped segment files.
+
+    Segments are named after their creation time, so a time-range query only
+    opens the segments whose span overlaps it and binary searches inside them.
+    """
+
+    def __init__(self, directory, segment_records=ARCHIVE_SEGMENT_RECORDS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.lock = threading.Lock()
+        self.active = None
+        os.makedirs(directory, exist_ok=True)
+        self.resume_or_create()
+
+    def segment_paths(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'segment-*.arc')))
+
+    def resume_or_create(self):
+        """Keep appending to the newest segment if it is intact and has room"""
+        paths = self.segment_paths()
+        if paths:
+            try:
+                segment = self.open_segment(paths[-1], writable=True)
+                if segment['bucket'] == 0 and segment['count'] < segment['capacity']:
+                    self.active = segment
+                    logger.info(f"Metrics archive: resuming {paths[-1]} at record {segment['count']}")
+                    return
+                self.close_segment(segment)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Metrics archive: not resuming {paths[-1]}: {str(e)}")
+        self.active = self.create_segment(time.time(), self.segment_records)
+
+    def create_segment(self, created, capacity, bucket=0, path=None):
+        if path is None:
+            # Never reuse a name: a second segment in the same millisecond, or
+            # after the clock stepped back, must not truncate a sealed one
+            stamp = int(created * 1000)
+            while True:
+                path = os.path.join(self.directory, f"segment-{stamp:015d}.arc")
+                try:
+                    f = open(path, 'xb')
+                    break
+                except FileExistsError:
+                    stamp += 1
+        else:
+            # Explicit paths are scratch files, possibly left over from a crash
+            f = open(path, 'wb')
+        with f:
+            header = ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, ARCHIVE_RECORD_SIZE,
+                                         capacity, created, bucket)
+            f.write(header.ljust(ARCHIVE_HEADER_SIZE, b'\0'))
+            # Preallocate so appends never change the file size
+            f.truncate(ARCHIVE_HEADER_SIZE + capacity * ARCHIVE_RECORD_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+        return self.open_segment(path, writable=True)
+
+    def open_segment(self, path, writable=False):
+        f = open(path, 'r+b' if writable else 'rb')
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            f.close()
+            raise
+        magic, version, record_size, capacity, created, bucket = ARCHIVE_HEADER.unpack_from(mm, 0)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION or record_size != ARCHIVE_RECORD_SIZE:
+            mm.close()
+            f.close()
+            raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} archive segment")
+        segment = {
+            'path': path, 'file': f, 'mmap': mm, 'capacity': capacity,
+            'created': created, 'bucket': bucket, 'count': 0
+        }
+        segment['count'] = self.find_end(segment)
+        return segment
+
+    @staticmethod
+    def close_segment(segment):
+        segment['mmap'].close()
+        segment['file'].close()
+
+    @staticmethod
+    def read_record(segment, index):
+        """Decode record index, or None if the slot is empty or torn"""
+        offset = ARCHIVE_HEADER_SIZE + index * ARCHIVE_RECORD_SIZE
+        body = segment['mmap'][offset:offset + ARCHIVE_RECORD.size]
+        (checksum,) = ARCHIVE_CHECKSUM.unpack_from(segment['mmap'], offset + ARCHIVE_RECORD.size)
+        if zlib.crc32(body) != checksum:
+            return None
+        return ARCHIVE_RECORD.unpack(body)
+
+    def find_end(self, segment):
+        """Index of the first empty or torn slot"""
+        # Valid records are contiguous from the start, so binary search works
+        low, high = 0, segment['capacity']
+        while low < high:
+            middle = (low + high) // 2
+            if self.read_record(segment, middle) is None:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def append(self, values):
+        """Append one sample (a tuple in ARCHIVE_FIELDS order)"""
+        body = ARCHIVE_RECORD.pack(*values)
+        record = body + ARCHIVE_CHECKSUM.pack(zlib.crc32(body))
+        with self.lock:
+            segment = self.active
+            if segment is None:
+                # Closed during shutdown
+                return
+            offset = ARCHIVE_HEADER_SIZE + segment['count'] * ARCHIVE_RECORD_SIZE
+            segment['mmap'][offset:offset + ARCHIVE_RECORD_SIZE] = record
+            # Flush just the pages holding this record
+            page_start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            segment['mmap'].flush(page_start, offset + ARCHIVE_RECORD_SIZE - page_start)
+            segment['count'] += 1
+            if segment['count'] >= segment['capacity']:
+                self.close_segment(segment)
+                self.active = self.create_segment(time.time(), self.segment_records)
+                rotated = True
+            else:
+                rotated = False
+        if rotated:
+            self.compact()
+
+    def close(self):
+        with self.lock:
+            if self.active:
+                self.active['mmap'].flush()
+                self.close_segment(self.active)
+                self.active = None
+
+    def segment_spans(self):
+        """(path, start, end) for every segment; a segment ends where the next begins"""
+        paths = self.segment_paths()
+        starts = [int(os.path.basename(path)[8:-4]) / 1000 for path in paths]
+        ends = starts[1:] + [float('inf')]
+        return list(zip(paths, starts, ends))
+
+    def query(self, start, end, limit):
+        """Records with start <= timestamp <= end, reading only overlapping segments"""
+        records = []
+        scanned = 0
+        truncated = False
+        for path, segment_start, segment_end in self.segment_spans():
+            if segment_end < start or segment_start > end:
+                continue
+            try:
+                segment = self.open_segment(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Metrics archive: skipping {path}: {str(e)}")
+                continue
+            scanned += 1
+            try:
+                # Records are in time order; find the first one >= start
+                low, high = 0, segment['count']
+                while low < high:
+                    middle = (low + high) // 2
+                    if self.read_record(segment, middle)[0] < start:
+                        low = middle + 1
+                    else:
+                        high = middle
+                for index in range(low, segment['count']):
+                    values = self.read_record(segment, index)
+                    if values is None or values[0] > end:
+                        break
+                    if len(records) >= limit:
+                        truncated = True
+                        break
+                    records.append(self.decode(values, segment['bucket']))
+            finally:
+                self.close_segment(segment)
+            if truncated:
+                break
+        return records, scanned, truncated
+
+    @staticmethod
+    def decode(values, bucket):
+        record = dict(zip(ARCHIVE_FIELDS, values))
+        record['time'] = datetime.datetime.fromtimestamp(record['timestamp']).isoformat()
+        record['db_status'] = ARCHIVE_DB_STATUSES[record['db_status']] if record['db_status'] < len(ARCHIVE_DB_STATUSES) else 'unknown'
+        record['state'] = ARCHIVE_STATES[record['state']] if record['state'] < len(ARCHIVE_STATES) else 'unknown'
+        for field in ('uptime_seconds', 'load_1m', 'load_5m', 'load_15m', 'latency_avg_ms', 'latency_max_ms'):
+            record[field] = round(record[field], 3)
+        if bucket:
+            record['bucket_seconds'] = bucket
+        return record
+
+    def compact(self):
+        """Downsample old sealed segments and drop expired ones"""
+        now = time.time()
+        active_path = self.active['path'] if self.active else None
+        for path, segment_start, segment_end in self.segment_spans():
+            if path == active_path:
+                continue
+            try:
+                if segment_end < now - ARCHIVE_RETENTION:
+                    os.remove(path)
+                    logger.info(f"Metrics archive: removed expired segment {path}")
+                elif segment_end < now - ARCHIVE_COMPACT_AFTER:
+                    self.compact_segment(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Metrics archive: compaction of {path} failed: {str(e)}")
+
+    def compact_segment(self, path):
+        """Rewrite a segment with one record per ARCHIVE_COMPACT_BUCKET seconds"""
+        segment = self.open_segment(path)
+        try:
+            if segment['bucket']:
+                return
+            buckets = []
+            for index in range(segment['count']):
+                values = self.read_record(segment, index)
+                bucket_start = values[0] - values[0] % ARCHIVE_COMPACT_BUCKET
+                if not buckets or buckets[-1][0] != bucket_start:
+                    buckets.append((bucket_start, []))
+                buckets[-1][1].append(values)
+        finally:
+            self.close_segment(segment)
+
+        # Write beside the original and rename over it, so a crash leaves
+        # either the old segment or the complete compacted one
+        temp_path = path + '.compacting'
+        compacted = self.create_segment(segment['created'], max(len(buckets), 1),
+                                        bucket=ARCHIVE_COMPACT_BUCKET, path=temp_path)
+        try:
+            for index, (bucket_start, samples) in enumerate(buckets):
+                body = ARCHIVE_RECORD.pack(*merge_archive_samples(bucket_start, samples))
+                offset = ARCHIVE_HEADER_SIZE + index * ARCHIVE_RECORD_SIZE
+                compacted['mmap'][offset:offset + ARCHIVE_RECORD_SIZE] = body + ARCHIVE_CHECKSUM.pack(zlib.crc32(body))
+            compacted['mmap'].flush()
+            os.fsync(compacted['file'].fileno())
+        finally:
+            self.close_segment(compacted)
+        os.replace(temp_path, path)
+        logger.info(f"Metrics archive: compacted {path} from {segment['count']} to {len(buckets)} records")
+
+def merge_archive_samples(bucket_start, samples):
+    """Combine samples into one bucket record (tuple in ARCHIVE_FIELDS order)"""
+    import statistics
+    last = samples[-1]
+    requests = sum(sample[10] for sample in samples)
+    latency_avg = (sum(sample[12] * sample[10] for sample in samples) / requests) if requests else 0.0
+    return (
+        bucket_start,
+        last[1],
+        last[2],
+        statistics.fmean(sample[3] for sample in samples),
+        statistics.fmean(sample[4] for sample in samples),
+        statistics.fmean(sample[5] for sample in samples),
+        last[6],
+        min(sample[7] for sample in samples),
+        last[8],
+        last[9],
+        requests,
+        sum(sample[11] for sample in samples),
+        latency_avg,
+        max(sample[13] for sample in samples),
+        max(sample[14] for sample in samples),
+        last[15],
+        last[16]
+    )
+
+# Helper functions
+def format_from_accept(accept):
+    """Return the response format selected by an Accept header value.
+
+    Media types are considered in order of their q-value; anything that
+    does not name a supported type falls back to pretty-printed JSON.
+    """
+    candidates = []
+    for position, item in enumerate(accept.split(',')):
+        params = [param.strip() for param in item.split(';')]
+        media_type = params[0].lower()
+        quality = 1.0
+        indent = None
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            key = key.strip().lower()
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+            elif key == 'indent':
+                indent = value.strip()
+        if media_type in ACCEPT_FORMATS and quality > 0:
+            candidates.append((-quality, position, media_type, indent))
+
+    if not candidates:
+        return 'json'
+    _, _, media_type, indent = min(candidates)
+    response_format = ACCEPT_FORMATS[media_type]
+    if response_format == 'json' and indent == '0':
+        return 'compact'
+    return response_format
+
+def project_fields(data, fields):
+    """Keep only the dotted field paths listed in fields.
+
+    "database.status" selects data['database']['status'] and keeps its
+    nesting in the result. Paths that do not exist are left out.
+    """
+    # A field whose ancestor is also requested is already covered, and
+    # dropping it keeps the result from writing into shared sub-dicts.
+    wanted = list(dict.fromkeys(fields))
+    selected = [
+        field for field in wanted
+        if not any(field.startswith(parent + '.') for parent in wanted)
+    ]
+
+    result = {}
+    for field in selected:
+        parts = field.split('.')
+        value = data
+        for part in parts:
+            if isinstance(value, dict) and part in value:
+                value = value[part]
+            else:
+                break
+        else:
+            target = result
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return result
+
+def encode_response(data, response_format):
+    """Serialize data for one of RESPONSE_FORMATS"""
+    if response_format == 'compact':
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if response_format == 'ndjson':
+        # Lists become one record per line, anything else a single record
+        records = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode('utf-8')
+    if response_format == 'msgpack':
+        return encode_msgpack(data)
+    return json.dumps(data, indent=2).encode('utf-8')
+
+def encode_msgpack(data):
+    """Encode data as MessagePack, using the msgpack package when installed"""
+    try:
+        import msgpack
+    except ImportError:
+        msgpack = None
+
+    if msgpack is not None:
+        return msgpack.packb(data, use_bin_type=True, default=str)
+
+    buffer = bytearray()
+    _pack_msgpack(data, buffer)
+    return bytes(buffer)
+
+def _pack_msgpack(value, buffer):
+    """Pure-Python MessagePack encoder used when msgpack is not installed"""
+    if value is None:
+        buffer.append(0xc0)
+    elif value is True:
+        buffer.append(0xc3)
+    elif value is False:
+        buffer.append(0xc2)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            buffer.append(value)
+        elif -32 <= value < 0:
+            buffer.append(value & 0xff)
+        elif 0 <= value <= 0xff:
+            buffer += struct.pack('>BB', 0xcc, value)
+        elif 0 <= value <= 0xffff:
+            buffer += struct.pack('>BH', 0xcd, value)
+        elif 0 <= value <= 0xffffffff:
+            buffer += struct.pack('>BI', 0xce, value)
+        elif 0 <= value <= 0xffffffffffffffff:
+            buffer += struct.pack('>BQ', 0xcf, value)
+        elif -0x80 <= value < 0:
+            buffer += struct.pack('>Bb', 0xd0, value)
+        elif -0x8000 <= value < 0:
+            buffer += struct.pack('>Bh', 0xd1, value)
+        elif -0x80000000 <= value < 0:
+            buffer += struct.pack('>Bi', 0xd2, value)
+        elif -0x8000000000000000 <= value < 0:
+            buffer += struct.pack('>Bq', 0xd3, value)
+        else:
+            # Out of MessagePack's integer range
+            _pack_msgpack(str(value), buffer)
+    elif isinstance(value, float):
+        buffer += struct.pack('>Bd', 0xcb, value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        length = len(encoded)
+        if length < 32:
+            buffer.append(0xa0 | length)
+        elif length <= 0xff:
+            buffer += struct.pack('>BB', 0xd9, length)
+        elif length <= 0xffff:
+            buffer += struct.pack('>BH', 0xda, length)
+        else:
+            buffer += struct.pack('>BI', 0xdb, length)
+        buffer += encoded
+    elif isinstance(value, (bytes, bytearray)):
+        length = len(value)
+        if length <= 0xff:
+            buffer += struct.pack('>BB', 0xc4, length)
+        elif length <= 0xffff:
+            buffer += struct.pack('>BH', 0xc5, length)
+        else:
+            buffer += struct.pack('>BI', 0xc6, length)
+        buffer += value
+    elif isinstance(value, (list, tuple)):
+        length = len(value)
+        if length < 16:
+            buffer.append(0x90 | length)
+        elif length <= 0xffff:
+            buffer += struct.pack('>BH', 0xdc, length)
+        else:
+            buffer += struct.pack('>BI', 0xdd, length)
+        for item in value:
+            _pack_msgpack(item, buffer)
+    elif isinstance(value, dict):
+        length = len(value)
+        if length < 16:
+            buffer.append(0x80 | length)
+        elif length <= 0xffff:
+            buffer += struct.pack('>BH', 0xde, length)
+        else:
+            buffer += struct.pack('>BI', 0xdf, length)
+        for key, item in value.items():
+            _pack_msgpack(key, buffer)
+            _pack_msgpack(item, buffer)
+    else:
+        # Same fallback as msgpack.packb(default=str)
+        _pack_msgpack(str(value), buffer)
+
+def lookup_static_file(url_path):
+    """Return cached metadata for a file under STATIC_DIR, or None.
+
+    Hits and misses are both remembered for STATIC_METADATA_TTL seconds so
+    repeat requests skip the stat() calls entirely.
+    """
+    now = time.monotonic()
+    with STATIC_METADATA_LOCK:
+        cached = STATIC_METADATA_CACHE.get(url_path)
+        if cached is not None and now - cached[0] < STATIC_METADATA_TTL:
+            STATIC_METADATA_CACHE.move_to_end(url_path)
+            return cached[1]
+
+    static_file = stat_static_file(url_path)
+
+    with STATIC_METADATA_LOCK:
+        STATIC_METADATA_CACHE[url_path] = (now, static_file)
+        STATIC_METADATA_CACHE.move_to_end(url_path)
+        while len(STATIC_METADATA_CACHE) > STATIC_METADATA_MAX_ENTRIES:
+            STATIC_METADATA_CACHE.popitem(last=False)
+    return static_file
+
+def forget_static_file(url_path):
+    """Drop a path from the static metadata cache"""
+    with STATIC_METADATA_LOCK:
+        STATIC_METADATA_CACHE.pop(url_path, None)
+
+def guess_static_type(file_path):
+    """Content-Type for a static file, loading the mimetypes database on first use"""
+    import mimetypes
+    if not mimetypes.inited:
+        mimetypes.init()
+        for content_type, extension in STATIC_EXTRA_TYPES:
+            mimetypes.add_type(content_type, extension)
+    return mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+def stat_static_file(url_path):
+    """Resolve url_path inside STATIC_DIR and collect the metadata needed to serve it"""
+    relative = unquote(url_path).lstrip('/')
+    if '\0' in relative:
+        # realpath() and stat() raise ValueError on embedded NUL bytes
+        return None
+    file_path = os.path.realpath(os.path.join(STATIC_DIR, relative))
+    # Refuse anything that escapes the static root (../, symlinks out)
+    if file_path != STATIC_DIR and not file_path.startswith(STATIC_DIR + os.sep):
+        return None
+    if os.path.isdir(file_path):
+        file_path = os.path.join(file_path, 'index.html')
+
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if not os.path.isfile(file_path):
+        return None
+
+    content_type = guess_static_type(file_path)
+    if content_type.startswith('text/') or content_type in ('application/json', 'image/svg+xml'):
+        content_type += '; charset=utf-8'
+
+    if (HASHED_ASSET_PATTERN.match(os.path.relpath(file_path, STATIC_DIR))
+            and not file_path.endswith('.html')):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'no-cache'
+
+    variants = {}
+    for encoding, suffix in STATIC_ENCODINGS:
+        try:
+            variant_stat = os.stat(file_path + suffix)
+        except OSError:
+            continue
+        # A sibling older than its source is a leftover from a previous build
+        if variant_stat.st_mtime_ns >= stat.st_mtime_ns:
+            variants[encoding] = {
+                'path': file_path + suffix,
+                'size': variant_stat.st_size,
+                'etag': make_etag(variant_stat, encoding)
+            }
+
+    return {
+        'url_path': url_path,
+        'path': file_path,
+        'size': stat.st_size,
+        'etag': make_etag(stat),
+        'last_modified': datetime.datetime.fromtimestamp(
+            stat.st_mtime, datetime.timezone.utc
+        ).strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        'content_type': content_type,
+        'cache_control': cache_control,
+        'variants': variants
+    }
+
+def make_etag(stat, encoding=None):
+    """Strong ETag derived from a file's inode, size and modification time"""
+    tag = f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    if encoding:
+        tag += f"-{encoding}"
+    return f'"{tag}"'
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    # If-None-Match uses weak comparison
+    return etag in candidates or f'W/{etag}' in candidates
+
+def parse_accept_encoding(header):
+    """Parse Accept-Encoding into a dict of coding -> q-value"""
+    accepted = {}
+    for item in header.split(','):
+        params = [param.strip() for param in item.split(';')]
+        coding = params[0].lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+def parse_range_header(header, size):
+    """Parse a single byte range against a file size.
+
+    Returns (start, end) inclusive, None when the header should be ignored
+    (malformed or multiple ranges, which are answered with the full body),
+    or 'unsatisfiable'.
+    """
+    units, _, ranges = header.partition('=')
+    if units.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    start, sep, end = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start:
+            start = int(start)
+            end = int(end) if end else size - 1
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(end)
+            if suffix <= 0:
+                return 'unsatisfiable'
+            start = max(0, size - suffix)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def format_uptime(seconds):
+    """Format uptime in seconds to a readable string"""
+    days, remainder = divmod(seconds, 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    
+    parts = []
+    if days > 0:
+        parts.append(f"{int(days)}d")
+    if hours > 0:
+        parts.append(f"{int(hours)}h")
+    if minutes > 0:
+        parts.append(f"{int(minutes)}m")
+    parts.append(f"{int(seconds)}s")
+    
+    return " ".join(parts)
@@ -1,18 +1,50 @@
 #!/usr/bin/env python3
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import time
+# perf_counter() when this file started executing; see log_startup_timing()
+MODULE_START = time.perf_counter()
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import os
 import json
 import socket
-import platform
+import random
 import sys
-import subprocess
-import time
 import datetime
 import traceback
+import http.client
+# http.server already loads ssl (through http.client), so it stays eager.
+# platform, subprocess, argparse, statistics, hashlib, mimetypes and
+# logging.handlers are only needed by some endpoints and commands, and are
+# imported where they are used to keep them off the startup path.
 import ssl
 import logging
+import shutil
+import signal
+import tempfile
+import threading
+import math
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from urllib.parse import parse_qs, urlparse
 
+# The subsystems live in an importable module so their bytecode is cached
+from diagnostics import (
+    ARCHIVE_DB_STATUSES, ARCHIVE_DIR, ARCHIVE_INTERVAL, ARCHIVE_STATES, BACKUP_ROOT, CAPTURE_FILE,
+    CAPTURE_HEADERS, CAPTURE_MAX_BYTES, DISK_PROBE_DIR, DISK_PROBE_TIME_BUDGET, DNS_EXECUTOR,
+    DNS_MAX_SAMPLES, DNS_TIMEOUT, FLEET_EXECUTOR, FLEET_PEER_TIMEOUT, MetricsArchive,
+    QUERY_PLAN_BASELINE_FILE, QUERY_PLAN_INTERVAL, QUERY_PLAN_LAST, RESPONSE_FORMATS, STATIC_DIR,
+    STATIC_ENCODINGS, capture_logger, compare_dump_to_live, disk_io_rates, dns_check_names,
+    dns_record_types, dns_stats_summary, enable_traffic_capture, encode_response, etag_matches,
+    find_backup_dirs, forget_static_file, format_from_accept, format_uptime, get_host_identity,
+    get_peer_health, inspect_backup_cli, inspect_backup_dir, load_fleet_peers, load_query_catalog,
+    lookup_static_file, parse_accept_encoding, parse_archive_time, parse_range_header,
+    project_fields, query_plans_cli, record_dns_result, replay_cli, run_disk_probe,
+    run_query_plan_checks, run_query_plan_scheduler, seed_db_cli, summarize_fleet, timed_dns_lookup
+)
+
+IMPORTS_DONE = time.perf_counter()
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,6 +56,22 @@ logger = logging.getLogger('diagnostic-server')
 # Track server start time
 SERVER_START_TIME = time.time()
 
+# FAST_START=1 binds and serves before logging startup facts; the
+# environment scan and host facts move to a background warm-up
+FAST_START = os.environ.get('FAST_START', '0').lower() in ('1', 'true', 'yes')
+# Startup phase -> milliseconds, in order; logged once the server is listening
+STARTUP_PHASES = OrderedDict()
+STARTUP_STATE = {'process_start': None, 'first_response_ms': None, 'awaiting_first_response': True}
+
+# Platform and runtime facts that cannot change while the process runs,
+# gathered on first use (or by the FAST_START warm-up); see get_host_facts()
+HOST_FACTS = {}
+HOST_FACTS_LOCK = threading.Lock()
+
+# Seconds libpq may spend connecting for /api/database (batch sections
+# use their deadline when it is shorter)
+DATABASE_CONNECT_TIMEOUT = int(os.environ.get('DATABASE_CONNECT_TIMEOUT', 5))
+
 # Track database connection status
 DB_STATUS = {
     'status': 'unknown',
@@ -31,21 +79,217 @@ DB_STATUS = {
     'error': None
 }
 
+# Lifecycle state reported by /api/health. 'draining' means the server is
+# on its way out (SIGTERM) and load balancers should stop sending traffic.
+SERVER_LIFECYCLE = {
+    'state': 'serving',
+    'since': datetime.datetime.now().isoformat(),
+    'restart_requested': False,
+    # True in the standby copy that accepts while a restarting server drains
+    'standby': False,
+    # pid of that standby, handed to the re-exec'd server to retire
+    'handoff_pid': None
+}
+
+# SIGTERM handling: keep accepting for the grace period while health reports
+# 'draining', then stop accepting and give in-flight requests up to
+# DRAIN_TIMEOUT_SECONDS to finish
+DRAIN_GRACE_SECONDS = float(os.environ.get('DRAIN_GRACE_SECONDS', 5))
+DRAIN_TIMEOUT_SECONDS = float(os.environ.get('DRAIN_TIMEOUT_SECONDS', 25))
+# Idle keep-alive connections are closed after this long without a request
+KEEPALIVE_TIMEOUT_SECONDS = float(os.environ.get('KEEPALIVE_TIMEOUT_SECONDS', 15))
+
+# Set on the re-exec'd process to the listening socket it inherited
+LISTEN_FD_ENV = 'DIAG_LISTEN_FD'
+# SIGHUP handoff: a standby copy of the server is started on the same socket
+# and accepts while this process drains and re-execs. The standby reports
+# readiness on the pipe in HANDOFF_READY_ENV; HANDOFF_PID_ENV tells the
+# re-exec'd server which standby to retire once it is accepting again.
+HANDOFF_READY_ENV = 'DIAG_HANDOFF_READY_FD'
+HANDOFF_PID_ENV = 'DIAG_HANDOFF_PID'
+HANDOFF_READY_TIMEOUT = 10.0
+# A re-exec'd server inherits the listening socket without a readiness pipe.
+# exec() keeps the process, so /proc/self/stat still has the original start time
+REEXECUTED = LISTEN_FD_ENV in os.environ and HANDOFF_READY_ENV not in os.environ
+# Written by the server itself (never by the standby or the CLI commands)
+# so start-diagnostic-server.sh signals exactly this process
+PID_FILE = os.environ.get('DIAG_PID_FILE', os.path.join(tempfile.gettempdir(),
+                          f"diagnostic-server-{os.environ.get('PORT', 5000)}.pid"))
+
+# Request counters since startup plus the current sampling interval; the
+# interval fields are reset each time the metrics archive takes a sample
+REQUEST_STATS = {
+    'total': 0,
+    'errors': 0,
+    'interval_count': 0,
+    'interval_errors': 0,
+    'interval_latency_sum': 0.0,
+    'interval_latency_max': 0.0
+}
+REQUEST_STATS_LOCK = threading.Lock()
+
+# The running archive, set up by run_server when ARCHIVE_DIR is configured
+METRICS_ARCHIVE = None
+
+# /livez answers from this constant without touching any I/O
+LIVEZ_BODY = b'{"status":"ok"}'
+
+# /readyz runs the registered readiness checks in parallel; the whole
+# evaluation must finish within READY_DEADLINE and its verdict is reused
+# for READY_CACHE_TTL seconds
+READY_DEADLINE = float(os.environ.get('READY_DEADLINE', 2.0))
+READY_CACHE_TTL = float(os.environ.get('READY_CACHE_TTL', 2.0))
+# Optional app endpoint that must answer for this instance to be ready,
+# e.g. http://127.0.0.1:5000/api/health for the Node server
+READY_UPSTREAM_URL = os.environ.get('READY_UPSTREAM_URL')
+READY_MIN_FREE_MB = float(os.environ.get('READY_MIN_FREE_MB', 100))
+# name -> (check function, timeout in seconds); see register_readiness_check
+READINESS_CHECKS = OrderedDict()
+READY_CACHE = {'verdict': None, 'evaluated': None}
+# Serializes evaluations so concurrent probes share one run
+READY_LOCK = threading.Lock()
+READY_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='readiness')
+
+# Route table: path -> route dict, filled by register_route() below the
+# handler class. Dispatch is a single dict lookup; unknown paths fall
+# through to static files and then 404.
+ROUTES = {}
+# How long a request may wait for a concurrency slot (and after which a
+# running handler is logged as slow) when its route sets no timeout
+ROUTE_DEFAULT_TIMEOUT = float(os.environ.get('ROUTE_DEFAULT_TIMEOUT', 30.0))
+# Concurrency classes: name -> simultaneous requests allowed (None = unbounded).
+# Keeps slow disk/network/database diagnostics from tying up every thread.
+ROUTE_CONCURRENCY = {
+    'light': None,
+    'io': int(os.environ.get('ROUTE_CONCURRENCY_IO', 8)),
+    'database': int(os.environ.get('ROUTE_CONCURRENCY_DATABASE', 4)),
+}
+ROUTE_SEMAPHORES = {name: threading.BoundedSemaphore(limit)
+                    for name, limit in ROUTE_CONCURRENCY.items() if limit}
+
+# Response cache for routes with a ttl: encoded bodies keyed by path, query,
+# wire format and the route's vary headers, least recently used first.
+# A stale entry is still served for RESPONSE_CACHE_STALE_SECONDS past its
+# ttl while one background refresh replaces it. 0 bytes disables the cache.
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+RESPONSE_CACHE_STALE_SECONDS = float(os.environ.get('RESPONSE_CACHE_STALE_SECONDS', 30.0))
+# Query parameters that ask for fresh work skip the cache lookup
+RESPONSE_CACHE_BYPASS_PARAMS = ('refresh', 'run')
+RESPONSE_CACHE = OrderedDict()
+RESPONSE_CACHE_LOCK = threading.Lock()
+RESPONSE_CACHE_STATS = {
+    'hits': 0,
+    'stale_hits': 0,
+    'misses': 0,
+    'bypassed': 0,
+    'evictions': 0,
+    'expired': 0,
+    'refreshes': 0,
+    'refresh_failures': 0,
+    'bytes': 0,
+}
+RESPONSE_CACHE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+# Sections that can be requested through /api/batch.
+# Maps section name -> (collector method, default deadline in seconds,
+# route concurrency class it shares with its standalone endpoint)
+BATCH_SECTIONS = {
+    'health': ('collect_health_info', 5.0, 'light'),
+    'env': ('collect_env_info', 1.0, 'light'),
+    'headers': ('collect_headers_info', 1.0, 'light'),
+    'system': ('collect_system_info', 5.0, 'light'),
+    'database': ('collect_database_info', 10.0, 'database'),
+    'ssl-diagnostics': ('collect_ssl_diagnostics', 2.0, 'light'),
+    'disk': ('collect_disk_info', 3.0, 'io'),
+    'dns': ('collect_dns_info', DNS_TIMEOUT + 1.0, 'io'),
+}
+
+# Upper bound for a caller-supplied ?timeout= on /api/batch
+BATCH_MAX_TIMEOUT = 30.0
+
+# Shared worker pool for batch sections. A section that overruns its
+# deadline keeps its worker until it finishes, so size the pool to cover
+# every section at least twice over.
+BATCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=len(BATCH_SECTIONS) * 2,
+    thread_name_prefix='batch-section'
+)
+# database and io sections get their own pools, one worker per route
+# concurrency slot, so a stuck database cannot starve env or headers;
+# sections still queued at their deadline are cancelled
+BATCH_CLASS_EXECUTORS = {
+    name: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f'batch-{name}')
+    for name, limit in ROUTE_CONCURRENCY.items() if limit
+}
+# The bundle's index.html owns / in static file mode, so the diagnostic
+# home page moves to /_diag/ (where it is also always reachable)
+DIAG_HOME_PATH = '/_diag/' if STATIC_DIR else '/'
+
 class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
     # Override the default server version header for security
     server_version = 'DiagnosticServer/1.0'
     sys_version = ''
+    # Keep-alive, so fleet peers and proxies can reuse connections; every
+    # response that has a body must send Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT_SECONDS
+    # Headers and body go out in separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK (~40 ms) on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    # Negotiated per request in do_GET; class defaults cover errors raised
+    # before negotiation has happened
+    response_format = 'json'
+    response_fields = None
+    # Set per request by route_request() / do_HEAD()
+    route = None
+    log_sampled = True
+    head_only = False
+    cache_key = None
 
     # Ensure all requests get logged
     def log_message(self, format, *args):
         logger.info(f"{self.client_address[0]} - {format % args}")
+
+    def log_error(self, format, *args):
+        # Idle keep-alive connections expiring are routine, not errors
+        if format.startswith('Request timed out'):
+            return
+        super().log_error(format, *args)
+
+    def parse_request(self):
+        # A request line arrived: the connection is busy again until handled
+        self.server.connection_busy(self.request)
+        return super().parse_request()
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if not self.close_connection:
+            # Waiting for the next request on a kept-alive connection must
+            # not hold up a drain
+            self.server.connection_idle(self.request)
+
+    def log_request(self, code='-', size='-'):
+        # Routes with a log sampling rate skip most access lines; errors are always logged
+        if self.log_sampled or (isinstance(code, int) and code >= 400):
+            super().log_request(code, size)
+
+    def end_headers(self):
+        super().end_headers()
+        if self.head_only:
+            # Headers are out; anything a handler writes after them is dropped
+            self.wfile = DiscardWriter()
+
+    def send_response(self, code, message=None):
+        # Remember the status for request statistics
+        self.response_status = code
+        super().send_response(code, message)
+        if SERVER_LIFECYCLE['state'] == 'draining' and not self.close_connection:
+            # Send clients to the next server instead of keeping this connection
+            self.send_header('Connection', 'close')
     
     def handle_error(self, status_code, message):
         """Handle errors with proper HTTP response"""
-        self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        
         error_data = {
             'error': {
                 'status': status_code,
@@ -54,72 +298,227 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
             }
         }
         
-        self.wfile.write(json.dumps(error_data, indent=2).encode('utf-8'))
+        self.send_encoded_response(status_code, error_data)
     
-    def send_json_response(self, data):
+    def send_json_response(self, data, status_code=200):
         """Helper to send JSON responses"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+        if self.response_fields:
+            # Project before encoding so unrequested branches are never serialized
+            data = project_fields(data, self.response_fields)
+        self.send_encoded_response(status_code, data)
+
+    def send_encoded_response(self, status_code, data):
+        """Encode data in the negotiated wire format and send it"""
+        # HEAD encodes too, so Content-Length matches GET; end_headers drops the body
+        body = encode_response(data, self.response_format)
+        if self.cache_key is not None and status_code == 200:
+            store_cached_response(self.cache_key, body, self.response_format, self.cache_context)
+        self.send_response(status_code)
+        self.send_header('Content-type', RESPONSE_FORMATS[self.response_format])
+        self.send_header('Content-Length', str(len(body)))
+        if self.route is not None:
+            self.send_header('Vary', ', '.join(('Accept',) + self.route['vary']))
+            ttl = self.route['ttl'] if status_code < 400 else 0
+            self.send_header('Cache-Control', f'max-age={ttl:g}' if ttl else 'no-store')
+            if self.cache_key is not None:
+                self.send_header('X-Cache', 'MISS')
+        else:
+            self.send_header('Vary', 'Accept')
         self.end_headers()
-        self.wfile.write(json.dumps(data, indent=2).encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_head_response(self, status_code):
+        """Send the headers of a route's response without building its body"""
+        self.send_response(status_code)
+        self.send_header('Content-type', RESPONSE_FORMATS[self.response_format])
+        self.send_header('Vary', ', '.join(('Accept',) + self.route['vary']))
+        ttl = self.route['ttl'] if status_code < 400 else 0
+        self.send_header('Cache-Control', f'max-age={ttl:g}' if ttl else 'no-store')
+        self.end_headers()
+
+    def negotiate_response_format(self, query):
+        """Pick the wire format and field projection for this request.
+
+        ?format= takes precedence over the Accept header. Returns an error
+        message when the request asks for something unsupported.
+        """
+        if 'format' in query:
+            requested = query['format'][0].strip().lower()
+            if requested not in RESPONSE_FORMATS:
+                return f"Unknown format '{requested}'. Available: {', '.join(RESPONSE_FORMATS)}"
+            self.response_format = requested
+        else:
+            self.response_format = format_from_accept(self.headers.get('Accept', ''))
+
+        fields = []
+        for value in query.get('fields', []):
+            fields.extend(field.strip() for field in value.split(',') if field.strip())
+        self.response_fields = fields or None
+        return None
 
     def do_GET(self):
         """Handle GET requests"""
+        started = time.monotonic()
+        self.response_status = None
+        try:
+            self.route_request()
+        finally:
+            record_request_stats(time.monotonic() - started, self.response_status)
+            # pop() is atomic, so exactly one request reports itself
+            if STARTUP_STATE.pop('awaiting_first_response', False):
+                log_first_response(self.command, self.path, self.response_status)
+
+    def do_HEAD(self):
+        """Handle HEAD requests: routed like GET, without sending a body"""
+        wfile = self.wfile
+        self.head_only = True
+        try:
+            self.do_GET()
+        finally:
+            self.head_only = False
+            self.wfile = wfile
+
+    def capture_request(self):
+        """Append this request to the capture file"""
+        path, _, query = self.path.partition('?')
+        headers = {name: self.headers[name] for name in CAPTURE_HEADERS if name in self.headers}
+        capture_logger.info(json.dumps([round(time.time(), 3), self.command, path, query, headers],
+                                       separators=(',', ':')))
+
+    def route_request(self):
+        """Dispatch a request through the route table"""
         try:
             parsed_url = urlparse(self.path)
             path = parsed_url.path
+            route = self.route = ROUTES.get(path)
+            self.cache_key = None
+            self.log_sampled = route is None or random.random() < route['log_sample']
+            
+            if route is not None and route['raw']:
+                # e.g. liveness: answered before any parsing or negotiation
+                getattr(self, route['handler'])(None)
+                return
+            
+            # Raw routes stay free of file I/O, so liveness probes are never captured
+            if capture_logger.handlers:
+                self.capture_request()
+            
             query = parse_qs(parsed_url.query)
             
-            logger.info(f"Received request: {self.command} {path}")
+            if self.log_sampled:
+                logger.info(f"Received request: {self.command} {path}")
             
-            # Route handling
-            if path == '/' or path == '/index.html':
-                # Home page
-                self.send_home_page()
-            elif path == '/api/health':
-                # Health check endpoint
-                self.send_health_info()
-            elif path == '/api/env':
-                # Environment variables endpoint
-                self.send_env_info()
-            elif path == '/api/headers':
-                # Request headers endpoint
-                self.send_headers_info()
-            elif path == '/api/database':
-                # Database status endpoint
-                self.check_database()
-            elif path == '/api/system':
-                # System diagnostics endpoint
-                self.send_system_info()
-            elif path == '/api/ssl-diagnostics':
-                # SSL diagnostics page
-                self.send_ssl_diagnostics()
-            elif path == '/ssl-test':
-                # SSL test page
-                self.send_ssl_test_page()
+            format_error = self.negotiate_response_format(query)
+            if format_error:
+                self.handle_error(406, format_error)
+                return
+            
+            if route is not None:
+                self.dispatch_route(path, route, query)
             else:
-                # 404 Not Found
-                self.handle_error(404, f"Path '{path}' not found")
+                # Static file mode falls through to the configured directory
+                static_file = lookup_static_file(path) if STATIC_DIR else None
+                if static_file:
+                    self.send_static_file(static_file)
+                else:
+                    # 404 Not Found
+                    self.handle_error(404, f"Path '{path}' not found")
                 
         except Exception as e:
             logger.error(f"Error handling request: {str(e)}")
             logger.error(traceback.format_exc())
             self.handle_error(500, f"Internal server error: {str(e)}")
 
-    def send_home_page(self):
-        """Render the home page"""
+    def dispatch_route(self, path, route, query):
+        """Answer from the response cache or run the route's handler inside its concurrency class"""
+        if route['ttl'] and RESPONSE_CACHE_MAX_BYTES:
+            key = response_cache_key(path, query, self.response_format, route, self.headers)
+            bypass = ('no-cache' in self.headers.get('Cache-Control', '')
+                      or any(name in query for name in RESPONSE_CACHE_BYPASS_PARAMS))
+            entry, fresh = (None, False) if bypass else lookup_cached_response(key)
+            if entry is not None:
+                self.send_cached_response(entry, fresh)
+                return
+            with RESPONSE_CACHE_LOCK:
+                RESPONSE_CACHE_STATS['bypassed' if bypass else 'misses'] += 1
+            self.cache_key = key
+            # What a background refresh needs to re-run this request later
+            self.cache_context = {
+                'server': self.server,
+                'client_address': self.client_address,
+                'command': 'GET',
+                'path': self.path,
+                'requestline': self.requestline,
+                'request_version': self.request_version,
+                'headers': self.headers,
+                'route': route,
+                'query': query,
+            }
+
+        if self.head_only and route['head'] is not True:
+            # HEAD never builds the body (nor runs ?run=1 / ?probe=1 work):
+            # a cache miss gets the route's headers and a status
+            self.send_head_response(getattr(self, route['head'])(query) if route['head'] else 200)
+            return
+
+        semaphore = ROUTE_SEMAPHORES.get(route['concurrency'])
+        if semaphore is not None and not semaphore.acquire(timeout=route['timeout']):
+            self.handle_error(503, f"Too many concurrent '{route['concurrency']}' requests, try again later")
+            return
+        started = time.monotonic()
+        try:
+            getattr(self, route['handler'])(query)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+        elapsed = time.monotonic() - started
+        if elapsed > route['timeout']:
+            logger.warning(f"Slow request: {path} took {elapsed:.2f}s (route timeout {route['timeout']:g}s)")
+
+    def send_cached_response(self, entry, fresh):
+        """Send a response body straight from the response cache"""
+        route = entry['context']['route']
+        age = time.monotonic() - entry['stored']
         self.send_response(200)
-        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-type', RESPONSE_FORMATS[entry['format']])
+        self.send_header('Content-Length', str(len(entry['body'])))
+        self.send_header('Vary', ', '.join(('Accept',) + route['vary']))
+        self.send_header('Cache-Control', f"max-age={max(0, int(route['ttl'] - age))}")
+        self.send_header('Age', str(int(age)))
+        self.send_header('X-Cache', 'HIT' if fresh else 'STALE')
         self.end_headers()
+        self.wfile.write(entry['body'])
+
+    def send_cache_info(self, query=None):
+        """API endpoint for response cache statistics"""
+        with RESPONSE_CACHE_LOCK:
+            stats = dict(RESPONSE_CACHE_STATS)
+            routes = {}
+            for entry in RESPONSE_CACHE.values():
+                path = entry['context']['route']['path']
+                routes[path] = routes.get(path, 0) + 1
+            entries = len(RESPONSE_CACHE)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        self.send_json_response({
+            'enabled': RESPONSE_CACHE_MAX_BYTES > 0,
+            'max_bytes': RESPONSE_CACHE_MAX_BYTES,
+            'stale_seconds': RESPONSE_CACHE_STALE_SECONDS,
+            'entries': entries,
+            'hit_ratio': round((stats['hits'] + stats['stale_hits']) / lookups, 3) if lookups else None,
+            'counters': stats,
+            'entries_by_route': routes,
+            'route_ttls': {path: route['ttl'] for path, route in ROUTES.items() if route['ttl']}
+        })
+
+    def send_home_page(self, query=None):
+        """Render the home page"""
         
         # Get uptime
         uptime = time.time() - SERVER_START_TIME
         uptime_str = format_uptime(uptime)
         
-        try:
-            node_version = subprocess.check_output(['node', '--version']).decode('utf-8').strip()
-        except:
-            node_version = "Not installed"
+        facts = get_host_facts()
+        node_version = facts['node_version']
         
         html = f"""
         <!DOCTYPE html>
@@ -246,7 +645,7 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                             </tr>
                             <tr>
                                 <td>Python Version</td>
-                                <td>{platform.python_version()}</td>
+                                <td>{facts['python_version']}</td>
                             </tr>
                             <tr>
                                 <td>Node.js Version</td>
@@ -260,6 +659,10 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                                 <td>Protocol</td>
                                 <td>{self.headers.get('X-Forwarded-Proto', 'http')}</td>
                             </tr>
+                            <tr>
+                                <td>Static Files</td>
+                                <td>{STATIC_DIR or 'Disabled'}</td>
+                            </tr>
                         </table>
                     </div>
                 </div>
@@ -275,6 +678,16 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                             <li><a href="/api/database">/api/database</a> - Database status</li>
                             <li><a href="/api/ssl-diagnostics">/api/ssl-diagnostics</a> - SSL info</li>
                             <li><a href="/ssl-test">/ssl-test</a> - HTTPS/SSL test page</li>
+                            <li><a href="/api/batch?sections=health,system,database">/api/batch</a> - Several sections in one request</li>
+                            <li><a href="/api/fleet">/api/fleet</a> - Health across peer servers</li>
+                            <li><a href="/api/backups">/api/backups</a> - Backup inventory (<a href="/api/backups?compare=1">drift</a>)</li>
+                            <li><a href="/api/archive">/api/archive</a> - Archived metrics (last hour)</li>
+                            <li><a href="/api/disk">/api/disk</a> - Disk I/O (<a href="/api/disk?probe=1">with fsync probe</a>)</li>
+                            <li><a href="/api/dns">/api/dns</a> - DNS resolution timing</li>
+                            <li><a href="/api/query-plans">/api/query-plans</a> - Query plan regressions (<a href="/api/query-plans?run=1">re-check</a>)</li>
+                            <li><a href="/api/cache">/api/cache</a> - Response cache statistics</li>
+                            <li><a href="/livez">/livez</a> - Liveness probe</li>
+                            <li><a href="/readyz">/readyz</a> - Readiness probe</li>
                         </ul>
                     </div>
                 </div>
@@ -326,11 +739,11 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                             </tr>
                             <tr>
                                 <td>Platform</td>
-                                <td>{platform.platform()}</td>
+                                <td>{facts['platform']}</td>
                             </tr>
                             <tr>
                                 <td>Python</td>
-                                <td>{platform.python_version()}</td>
+                                <td>{facts['python_version']}</td>
                             </tr>
                             <tr>
                                 <td>Node.js</td>
@@ -371,22 +784,33 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
         </html>
         """
         
-        self.wfile.write(html.encode('utf-8'))
+        body = html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-    def send_health_info(self):
+    def send_health_info(self, query=None):
         """API endpoint for health status"""
-        # Try to detect Node.js
-        node_version = "Not installed"
-        try:
-            node_version = subprocess.check_output(['node', '--version']).decode('utf-8').strip()
-        except:
-            pass
+        health_data = self.collect_health_info()
+        # 503 while draining so load balancers take this instance out of rotation
+        self.send_json_response(health_data, 503 if health_data['status'] == 'draining' else 200)
+
+    def health_status(self, query=None):
+        """Status code of /api/health, from the lifecycle state alone"""
+        return 503 if SERVER_LIFECYCLE['state'] == 'draining' else 200
+
+    def collect_health_info(self):
+        """Gather health status data"""
+        facts = get_host_facts()
         
         # Calculate uptime
         uptime = time.time() - SERVER_START_TIME
         
+        draining = SERVER_LIFECYCLE['state'] == 'draining'
         health_data = {
-            'status': 'ok',
+            'status': 'draining' if draining else 'ok',
             'timestamp': datetime.datetime.now().isoformat(),
             'hostname': socket.gethostname(),
             'request': {
@@ -403,14 +827,16 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                 'repl_owner': os.environ.get('REPL_OWNER', None)
             },
             'server': {
+                'state': SERVER_LIFECYCLE['state'],
+                'state_since': SERVER_LIFECYCLE['since'],
                 'uptime_seconds': uptime,
                 'uptime_formatted': format_uptime(uptime),
-                'python_version': platform.python_version(),
-                'node_version': node_version, 
-                'platform': platform.platform(),
-                'system': platform.system(),
-                'machine': platform.machine(),
-                'processor': platform.processor()
+                'python_version': facts['python_version'],
+                'node_version': facts['node_version'],
+                'platform': facts['platform'],
+                'system': facts['system'],
+                'machine': facts['machine'],
+                'processor': facts['processor']
             },
             'database': {
                 'is_configured': 'DATABASE_URL' in os.environ,
@@ -420,10 +846,14 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
             }
         }
         
-        self.send_json_response(health_data)
+        return health_data
 
-    def send_env_info(self):
+    def send_env_info(self, query=None):
         """API endpoint for environment variables"""
+        self.send_json_response(self.collect_env_info())
+
+    def collect_env_info(self):
+        """Gather the filtered set of environment variables"""
         # Filter environment variables for security
         env_data = {
             'NODE_ENV': os.environ.get('NODE_ENV', 'not set'),
@@ -442,116 +872,136 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
             'PWD': os.environ.get('PWD', 'not set'),
         }
         
-        self.send_json_response(env_data)
+        return env_data
 
-    def send_headers_info(self):
+    def send_headers_info(self, query=None):
         """API endpoint for request headers"""
-        headers = dict(self.headers)
-        self.send_json_response(headers)
+        self.send_json_response(self.collect_headers_info())
+
+    def collect_headers_info(self):
+        """Gather the request headers"""
+        return dict(self.headers)
     
-    def send_system_info(self):
+    def send_system_info(self, query=None):
         """API endpoint for system information"""
         try:
-            memory_info = {}
-            try:
-                meminfo = {}
-                with open('/proc/meminfo', 'r') as f:
-                    for line in f:
-                        parts = line.split(':')
-                        if len(parts) == 2:
-                            meminfo[parts[0].strip()] = parts[1].strip()
-                
-                memory_info = {
-                    'total': meminfo.get('MemTotal', 'unknown'),
-                    'free': meminfo.get('MemFree', 'unknown'),
-                    'available': meminfo.get('MemAvailable', 'unknown'),
-                    'buffers': meminfo.get('Buffers', 'unknown'),
-                    'cached': meminfo.get('Cached', 'unknown')
-                }
-            except:
-                memory_info = {'error': 'Unable to read memory information'}
-            
-            cpu_info = {}
-            try:
-                cpuinfo = {}
-                with open('/proc/cpuinfo', 'r') as f:
-                    for line in f:
-                        parts = line.split(':')
-                        if len(parts) == 2:
-                            cpuinfo[parts[0].strip()] = parts[1].strip()
-                
-                cpu_info = {
-                    'model': cpuinfo.get('model name', 'unknown'),
-                    'cores': cpuinfo.get('cpu cores', 'unknown'),
-                    'mhz': cpuinfo.get('cpu MHz', 'unknown')
-                }
-            except:
-                cpu_info = {'error': 'Unable to read CPU information'}
-            
-            # Process information
-            process_info = {
-                'pid': os.getpid(),
-                'ppid': os.getppid(),
-                'exe': sys.executable,
-                'python_version': sys.version,
-                'argv': sys.argv,
-                'cwd': os.getcwd()
-            }
+            self.send_json_response(self.collect_system_info())
+        except Exception as e:
+            logger.error(f"Error in system_info: {str(e)}")
+            self.handle_error(500, f"Error getting system information: {str(e)}")
+
+    def collect_system_info(self):
+        """Gather memory, CPU, process and network information"""
+        memory_info = {}
+        try:
+            meminfo = {}
+            with open('/proc/meminfo', 'r') as f:
+                for line in f:
+                    parts = line.split(':')
+                    if len(parts) == 2:
+                        meminfo[parts[0].strip()] = parts[1].strip()
             
-            # Network information
-            # server_address is a tuple (host, port)
-            server_address = self.server.server_address if hasattr(self.server, 'server_address') else ('unknown', 0)
-            try:
-                listen_address = server_address[0] if isinstance(server_address, tuple) and len(server_address) > 0 else 'unknown'
-                listen_port = server_address[1] if isinstance(server_address, tuple) and len(server_address) > 1 else 0
-            except (IndexError, TypeError):
-                listen_address = 'unknown'
-                listen_port = 0
-                
-            network_info = {
-                'hostname': socket.gethostname(),
-                'fqdn': socket.getfqdn(),
-                'listen_port': listen_port,
-                'listen_address': listen_address
+            memory_info = {
+                'total': meminfo.get('MemTotal', 'unknown'),
+                'free': meminfo.get('MemFree', 'unknown'),
+                'available': meminfo.get('MemAvailable', 'unknown'),
+                'buffers': meminfo.get('Buffers', 'unknown'),
+                'cached': meminfo.get('Cached', 'unknown')
             }
+        except:
+            memory_info = {'error': 'Unable to read memory information'}
+        
+        cpu_info = {}
+        try:
+            cpuinfo = {}
+            with open('/proc/cpuinfo', 'r') as f:
+                for line in f:
+                    parts = line.split(':')
+                    if len(parts) == 2:
+                        cpuinfo[parts[0].strip()] = parts[1].strip()
             
-            system_data = {
-                'platform': {
-                    'system': platform.system(),
-                    'node': platform.node(),
-                    'release': platform.release(),
-                    'version': platform.version(),
-                    'machine': platform.machine(),
-                    'processor': platform.processor(),
-                    'architecture': platform.architecture(),
-                    'python_version': platform.python_version(),
-                    'python_implementation': platform.python_implementation()
-                },
-                'memory': memory_info,
-                'cpu': cpu_info,
-                'process': process_info,
-                'network': network_info,
-                'uptime': format_uptime(time.time() - SERVER_START_TIME)
+            cpu_info = {
+                'model': cpuinfo.get('model name', 'unknown'),
+                'cores': cpuinfo.get('cpu cores', 'unknown'),
+                'mhz': cpuinfo.get('cpu MHz', 'unknown')
             }
+        except:
+            cpu_info = {'error': 'Unable to read CPU information'}
+        
+        # Process information
+        process_info = {
+            'pid': os.getpid(),
+            'ppid': os.getppid(),
+            'exe': sys.executable,
+            'python_version': sys.version,
+            'argv': sys.argv,
+            'cwd': os.getcwd()
+        }
+        
+        # Network information
+        # server_address is a tuple (host, port)
+        server_address = self.server.server_address if hasattr(self.server, 'server_address') else ('unknown', 0)
+        try:
+            listen_address = server_address[0] if isinstance(server_address, tuple) and len(server_address) > 0 else 'unknown'
+            listen_port = server_address[1] if isinstance(server_address, tuple) and len(server_address) > 1 else 0
+        except (IndexError, TypeError):
+            listen_address = 'unknown'
+            listen_port = 0
             
-            self.send_json_response(system_data)
-        except Exception as e:
-            logger.error(f"Error in system_info: {str(e)}")
-            self.handle_error(500, f"Error getting system information: {str(e)}")
+        identity = get_host_identity()
+        network_info = {
+            'hostname': identity['hostname'],
+            'fqdn': identity['fqdn'],
+            'fqdn_status': identity['status'],
+            'listen_port': listen_port,
+            'listen_address': listen_address
+        }
+        
+        facts = get_host_facts()
+        system_data = {
+            'platform': {
+                name: facts[name]
+                for name in ('system', 'node', 'release', 'version', 'machine', 'processor',
+                             'architecture', 'python_version', 'python_implementation')
+            },
+            'memory': memory_info,
+            'cpu': cpu_info,
+            'process': process_info,
+            'network': network_info,
+            'startup': {
+                'fast_start': FAST_START,
+                'phases_ms': dict(STARTUP_PHASES),
+                'first_response_ms': STARTUP_STATE['first_response_ms']
+            },
+            'uptime': format_uptime(time.time() - SERVER_START_TIME)
+        }
+        
+        return system_data
     
-    def check_database(self):
+    def check_database(self, query=None):
         """Check the database connection and return status"""
+        self.send_json_response(self.collect_database_info())
+
+    def database_status(self, query=None):
+        """Status code of /api/database without opening a connection.
+
+        The check reports failures in its body, so this is always 200;
+        DB_STATUS holds the outcome of the last GET.
+        """
+        return 200
+
+    def collect_database_info(self, connect_timeout=DATABASE_CONNECT_TIMEOUT):
+        """Connect to the database and gather its status"""
         if 'DATABASE_URL' not in os.environ:
             DB_STATUS['status'] = 'not_configured'
             DB_STATUS['last_checked'] = datetime.datetime.now().isoformat()
             DB_STATUS['error'] = "DATABASE_URL environment variable not set"
             
-            self.send_json_response({
+            return {
                 'status': 'not_configured',
                 'message': 'Database is not configured (DATABASE_URL not set)',
                 'timestamp': DB_STATUS['last_checked']
-            })
-            return
+            }
         
         try:
             # Try to check if we can connect to the database using psycopg2
@@ -581,13 +1031,12 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                         logger.error(f"Error getting pip version: {str(pip_err)}")
                         pip_version = f"Error: {str(pip_err)}"
                     
-                    self.send_json_response({
+                    return {
                         'status': 'module_install_failed',
                         'message': f'Failed to install psycopg2 module: {str(install_err)}',
                         'timestamp': DB_STATUS['last_checked'],
                         'pip_version': pip_version
-                    })
-                    return
+                    }
             
             db_url = os.environ['DATABASE_URL']
             conn = None
@@ -595,7 +1044,7 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
             
             try:
                 logger.info("Attempting database connection...")
-                conn = psycopg2.connect(db_url)
+                conn = psycopg2.connect(db_url, connect_timeout=connect_timeout)
                 cursor = conn.cursor()
                 
                 # Get database info
@@ -618,7 +1067,7 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                 DB_STATUS['last_checked'] = datetime.datetime.now().isoformat()
                 DB_STATUS['error'] = None
                 
-                self.send_json_response({
+                return {
                     'status': 'ok',
                     'message': 'Successfully connected to the database',
                     'timestamp': DB_STATUS['last_checked'],
@@ -627,7 +1076,7 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
                         'database': db_name,
                         'user': db_user
                     }
-                })
+                }
             finally:
                 # Ensure connections are properly closed
                 if cursor:
@@ -645,19 +1094,19 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
             DB_STATUS['last_checked'] = datetime.datetime.now().isoformat()
             DB_STATUS['error'] = str(e)
             
-            self.send_json_response({
+            return {
                 'status': 'error',
                 'message': f'Error connecting to database: {str(e)}',
                 'timestamp': DB_STATUS['last_checked'],
                 'error_details': traceback.format_exc()
-            })
+            }
 
-    def send_ssl_diagnostics(self):
+    def send_ssl_diagnostics(self, query=None):
         """API endpoint for SSL/HTTPS diagnostics"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        
+        self.send_json_response(self.collect_ssl_diagnostics())
+
+    def collect_ssl_diagnostics(self):
+        """Gather SSL capabilities and forwarded-protocol information"""
         # Get information about SSL capabilities and environment
         ssl_info = {
             'request': {
@@ -684,13 +1133,10 @@ class DiagnosticHTTPRequestHandler(BaseHTTPRequestHandler):
             }
         }
         
-        self.wfile.write(json.dumps(ssl_info, indent=2).encode('utf-8'))
+        return ssl_info
 
-    def send_ssl_test_page(self):
+    def send_ssl_test_page(self, query=None):
         """Render a dedicated SSL/HTTPS test page"""
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
         
         is_secure = self.headers.get('X-Forwarded-Proto') == 'https'
         host = self.headers.get('Host', 'unknown')
@@ -907,91 +1353,1212 @@ app.use((req, res, next) => {{
 }});</pre>
             </div>
             
-            <p><a href="/">← Back to Diagnostic Home</a></p>
+            <p><a href="{DIAG_HOME_PATH}">← Back to Diagnostic Home</a></p>
             
             <p><small>Generated at: {datetime.datetime.now().isoformat()}</small></p>
         </body>
         </html>
         """
         
-        self.wfile.write(html.encode('utf-8'))
-
-# Helper functions
-def format_uptime(seconds):
-    """Format uptime in seconds to a readable string"""
-    days, remainder = divmod(seconds, 86400)
-    hours, remainder = divmod(remainder, 3600)
-    minutes, seconds = divmod(remainder, 60)
+        body = html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_batch_info(self, query):
+        """API endpoint evaluating several diagnostic sections concurrently"""
+        requested = []
+        for value in query.get('sections', []):
+            for name in value.split(','):
+                name = name.strip()
+                if name and name not in requested:
+                    requested.append(name)
+        if not requested:
+            requested = list(BATCH_SECTIONS)
+
+        unknown = [name for name in requested if name not in BATCH_SECTIONS]
+        if unknown:
+            self.handle_error(400, f"Unknown sections: {', '.join(unknown)}. "
+                                   f"Available: {', '.join(BATCH_SECTIONS)}")
+            return
+
+        # Optional ?timeout= overrides every section's default deadline
+        timeout_override = None
+        if 'timeout' in query:
+            try:
+                timeout_override = float(query['timeout'][0])
+            except ValueError:
+                self.handle_error(400, f"Invalid timeout '{query['timeout'][0]}'")
+                return
+            if timeout_override <= 0:
+                self.handle_error(400, "Timeout must be greater than zero")
+                return
+            timeout_override = min(timeout_override, BATCH_MAX_TIMEOUT)
+
+        started = time.monotonic()
+        futures = {
+            name: BATCH_CLASS_EXECUTORS.get(BATCH_SECTIONS[name][2], BATCH_EXECUTOR).submit(
+                self.run_batch_section, name, started + (timeout_override or BATCH_SECTIONS[name][1]))
+            for name in requested
+        }
+
+        # Deadlines are measured from submission, so waiting on the sections
+        # one after another never stretches any of them.
+        sections = {}
+        for name, future in futures.items():
+            deadline = timeout_override or BATCH_SECTIONS[name][1]
+            remaining = max(0.0, started + deadline - time.monotonic())
+            try:
+                data, elapsed = future.result(timeout=remaining)
+                sections[name] = {
+                    'status': 'ok',
+                    'elapsed_ms': round(elapsed * 1000, 2),
+                    'data': data
+                }
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning(f"Batch section '{name}' exceeded its {deadline}s deadline")
+                sections[name] = {
+                    'status': 'timeout',
+                    'elapsed_ms': round(deadline * 1000, 2),
+                    'error': f"Section did not complete within {deadline}s"
+                }
+            except Exception as e:
+                logger.error(f"Batch section '{name}' failed: {str(e)}")
+                sections[name] = {
+                    'status': 'error',
+                    'elapsed_ms': round((time.monotonic() - started) * 1000, 2),
+                    'error': str(e)
+                }
+
+        incomplete = [name for name, section in sections.items() if section['status'] != 'ok']
+
+        self.send_json_response({
+            'timestamp': datetime.datetime.now().isoformat(),
+            'partial': bool(incomplete),
+            'incomplete_sections': incomplete,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 2),
+            'sections': sections
+        })
+
+    def send_static_file(self, static_file):
+        """Serve a file from STATIC_DIR with ETag, range and precompression support"""
+        etag = static_file['etag']
+        headers = {
+            'Content-type': static_file['content_type'],
+            'Last-Modified': static_file['last_modified'],
+            'Cache-Control': static_file['cache_control'],
+            'Accept-Ranges': 'bytes',
+            'Vary': 'Accept-Encoding',
+        }
+
+        # Ranges always address the identity representation; compressed
+        # siblings are only used for whole-file responses
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') not in (None, etag):
+            range_header = None
+
+        file_path = static_file['path']
+        size = static_file['size']
+        if not range_header:
+            accepted = parse_accept_encoding(self.headers.get('Accept-Encoding', ''))
+            for encoding, _ in STATIC_ENCODINGS:
+                variant = static_file['variants'].get(encoding)
+                if variant and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                    file_path = variant['path']
+                    size = variant['size']
+                    etag = variant['etag']
+                    headers['Content-Encoding'] = encoding
+                    break
+        headers['ETag'] = etag
+
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            for name in ('ETag', 'Cache-Control', 'Last-Modified', 'Vary'):
+                self.send_header(name, headers[name])
+            self.end_headers()
+            return
+
+        status_code = 200
+        offset = 0
+        count = size
+        if range_header:
+            byte_range = parse_range_header(range_header, size)
+            if byte_range == 'unsatisfiable':
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byte_range:
+                status_code = 206
+                offset, end = byte_range
+                count = end - offset + 1
+                headers['Content-Range'] = f'bytes {offset}-{end}/{size}'
+
+        try:
+            f = open(file_path, 'rb')
+        except OSError:
+            # The file went away since its metadata was cached
+            forget_static_file(static_file['url_path'])
+            self.handle_error(404, f"Path '{static_file['url_path']}' not found")
+            return
+
+        with f:
+            self.send_response(status_code)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(count))
+            self.end_headers()
+            if count and not self.head_only:
+                # socket.sendfile() hands the copy to os.sendfile() so the
+                # bytes go from the page cache to the socket without passing
+                # through Python, and falls back to send() where unavailable
+                self.connection.sendfile(f, offset, count)
+
+    def send_fleet_info(self, query):
+        """API endpoint aggregating /api/health across peer diagnostic servers"""
+        peers = load_fleet_peers()
+        if not peers:
+            self.handle_error(404, "No fleet peers configured (set FLEET_PEERS or FLEET_PEERS_FILE)")
+            return
+
+        refresh = query.get('refresh', ['0'])[0].lower() in ('1', 'true', 'yes')
+        started = time.monotonic()
+        futures = {peer: FLEET_EXECUTOR.submit(get_peer_health, peer, refresh) for peer in peers}
+
+        results = []
+        for peer, future in futures.items():
+            # The connection timeout bounds each peer; this only guards
+            # against a peer stuck behind a saturated worker pool
+            remaining = max(0.0, started + FLEET_PEER_TIMEOUT * 2 - time.monotonic())
+            try:
+                results.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                results.append({
+                    'peer': peer,
+                    'healthy': False,
+                    'status': 'timeout',
+                    'error': 'No result before the fleet deadline',
+                    'latency_ms': None,
+                    'cached': False
+                })
+
+        self.send_json_response({
+            'timestamp': datetime.datetime.now().isoformat(),
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 2),
+            **summarize_fleet(results),
+            'peers': results
+        })
+
+    def send_backup_info(self, query):
+        """API endpoint inspecting pg_dump backups and comparing them to the live database"""
+        backup_dirs = find_backup_dirs()
+        if 'backup' in query:
+            wanted = query['backup'][0]
+            backup_dirs = [path for path in backup_dirs if os.path.basename(path) == wanted]
+            if not backup_dirs:
+                self.handle_error(404, f"Backup '{wanted}' not found under {BACKUP_ROOT}")
+                return
+
+        backups = [inspect_backup_dir(path) for path in backup_dirs]
+        result = {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'backup_root': BACKUP_ROOT,
+            'backups': backups
+        }
+
+        if query.get('compare', ['0'])[0].lower() in ('1', 'true', 'yes'):
+            # Compare the newest backup (or the one asked for) that has table data;
+            # a newer schema-only dump must not hide an older full one
+            candidates = [backup for backup in backups
+                          if backup.get('primary_dump') and backup['primary_dump']['contains_data']]
+            if candidates:
+                result['drift'] = compare_dump_to_live(candidates[-1]['primary_dump'])
+            else:
+                result['drift'] = {'status': 'no_backup', 'message': 'No backup with table data was found'}
+
+        self.send_json_response(result)
+
+    def send_query_plan_info(self, query):
+        """API endpoint reporting query-plan regressions.
+
+        Plain requests report the last check and never run EXPLAIN ANALYZE;
+        ?run=1 checks now (?run=1&query=a,b only those queries).
+        """
+        names = [name for value in query.get('query', []) for name in value.split(',') if name]
+        run = query.get('run', ['0'])[0].lower() in ('1', 'true', 'yes')
+        last = QUERY_PLAN_LAST['result']
+        if run:
+            try:
+                catalog = load_query_catalog()
+            except (OSError, ValueError) as e:
+                self.handle_error(500, f"Cannot load query catalog: {str(e)}")
+                return
+            unknown = [name for name in names if name not in catalog]
+            if unknown:
+                self.handle_error(404, f"Unknown query: {', '.join(unknown)}")
+                return
+            result = run_query_plan_checks(names or None, catalog=catalog)
+        elif last is None:
+            result = {
+                'status': 'never_run',
+                'message': 'No check has run yet; request ?run=1 to run one now',
+                'interval_seconds': QUERY_PLAN_INTERVAL,
+                'baseline_file': QUERY_PLAN_BASELINE_FILE,
+            }
+        else:
+            result = dict(last, age_seconds=round(time.monotonic() - QUERY_PLAN_LAST['finished'], 1))
+            if names and 'queries' in last:
+                result['queries'] = {name: q for name, q in last['queries'].items() if name in names}
+        self.send_json_response(result)
+
+    def send_archive_info(self, query):
+        """API endpoint returning archived samples for a time range"""
+        if METRICS_ARCHIVE is None:
+            self.handle_error(404, "Metrics archive is disabled (set ARCHIVE_DIR)")
+            return
+
+        now = time.time()
+        try:
+            end = parse_archive_time(query['to'][0]) if 'to' in query else now
+            start = parse_archive_time(query['from'][0]) if 'from' in query else end - 3600
+            limit = min(int(query.get('limit', ['1000'])[0]), 10000)
+        except ValueError as e:
+            self.handle_error(400, f"Invalid archive query: {str(e)}")
+            return
+
+        records, segments_scanned, truncated = METRICS_ARCHIVE.query(start, end, limit)
+        self.send_json_response({
+            'from': datetime.datetime.fromtimestamp(start).isoformat(),
+            'to': datetime.datetime.fromtimestamp(end).isoformat(),
+            'directory': METRICS_ARCHIVE.directory,
+            'segments_total': len(METRICS_ARCHIVE.segment_paths()),
+            'segments_scanned': segments_scanned,
+            'count': len(records),
+            'truncated': truncated,
+            'records': records
+        })
+
+    def send_disk_info(self, query):
+        """API endpoint for disk I/O statistics"""
+        try:
+            window = float(query['window'][0]) if 'window' in query else None
+        except ValueError:
+            self.handle_error(400, f"Invalid window '{query['window'][0]}'")
+            return
+        if window is not None and not (math.isfinite(window) and window > 0):
+            self.handle_error(400, "Window must be a number greater than zero")
+            return
+        show_all = query.get('all', ['0'])[0].lower() in ('1', 'true', 'yes')
+        probe = query.get('probe', ['0'])[0].lower() in ('1', 'true', 'yes')
+        self.send_json_response(self.collect_disk_info(window, show_all, probe))
+
+    def collect_disk_info(self, window=None, show_all=False, probe=False):
+        """Gather per-device I/O rates, scratch space usage and the optional probe"""
+        # interval_seconds and devices, or error
+        disk_data = disk_io_rates(window, show_all)
+
+        try:
+            usage = shutil.disk_usage(DISK_PROBE_DIR)
+            disk_data['scratch'] = {
+                'path': DISK_PROBE_DIR,
+                'total_bytes': usage.total,
+                'free_bytes': usage.free,
+                'used_percent': round(100.0 * usage.used / usage.total, 1) if usage.total else None
+            }
+        except OSError as e:
+            disk_data['scratch'] = {'path': DISK_PROBE_DIR, 'error': str(e)}
+
+        if probe:
+            disk_data['probe'] = run_disk_probe()
+        return disk_data
+
+    def send_dns_info(self, query):
+        """API endpoint timing DNS resolution for the configured names"""
+        try:
+            samples = int(query.get('samples', ['1'])[0])
+        except ValueError:
+            self.handle_error(400, f"Invalid samples '{query['samples'][0]}'")
+            return
+        names = [name.strip() for value in query.get('names', []) for name in value.split(',') if name.strip()]
+        self.send_json_response(self.collect_dns_info(samples, names or None))
+
+    def collect_dns_info(self, samples=1, names=None):
+        """Resolve names as A, AAAA and PTR under DNS_TIMEOUT and report timing"""
+        samples = max(1, min(samples, DNS_MAX_SAMPLES))
+        names = names or dns_check_names()
+        started = time.monotonic()
+
+        futures = []
+        for name in names:
+            for record_type in dns_record_types(name):
+                for _ in range(samples):
+                    futures.append((name, record_type, DNS_EXECUTOR.submit(timed_dns_lookup, name, record_type)))
+
+        rounds = {}
+        for name, record_type, future in futures:
+            outcome = rounds.setdefault((name, record_type), {'ok': 0, 'failed': 0, 'timed_out': 0, 'queued': 0})
+            remaining = max(0.0, started + DNS_TIMEOUT - time.monotonic())
+            try:
+                result, error, elapsed = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                if future.cancel():
+                    # Never started because every worker was busy: the pool
+                    # was saturated, the resolver did not time out
+                    outcome['queued'] += 1
+                    record_dns_result(name, record_type, None, None, None, queued=True)
+                    continue
+                # The lookup keeps its worker until the resolver gives up
+                outcome['timed_out'] += 1
+                record_dns_result(name, record_type, None, f"No answer within {DNS_TIMEOUT}s", None, timed_out=True)
+                continue
+            outcome['ok' if error is None else 'failed'] += 1
+            record_dns_result(name, record_type, result, error, elapsed)
+
+        results = {}
+        for (name, record_type), outcome in rounds.items():
+            results.setdefault(name, {})[record_type] = dict(dns_stats_summary(name, record_type), this_request=outcome)
+
+        return {
+            'timeout_seconds': DNS_TIMEOUT,
+            'samples': samples,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 2),
+            'host_identity': get_host_identity(),
+            'names': results
+        }
+
+    def send_livez(self, query=None):
+        """Liveness probe: the process is up and serving HTTP"""
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(LIVEZ_BODY)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(LIVEZ_BODY)
+
+    def send_readyz(self, query):
+        """Readiness probe: 503 with per-check reasons when a dependency is down"""
+        refresh = query.get('refresh', ['0'])[0].lower() in ('1', 'true', 'yes')
+        verdict = evaluate_readiness(refresh)
+        self.send_json_response(verdict, 200 if verdict['status'] == 'ready' else 503)
+
+    def readyz_status(self, query=None):
+        """Status code of /readyz from the current (possibly cached) verdict"""
+        return 200 if evaluate_readiness(False)['status'] == 'ready' else 503
+
+    def run_batch_section(self, name, deadline_at):
+        """Run one batch section's collector in its concurrency class, returning (data, elapsed seconds)"""
+        collector, _, concurrency = BATCH_SECTIONS[name]
+        started = time.monotonic()
+        if started >= deadline_at:
+            # The batch already reported this section as timed out
+            raise RuntimeError("Deadline passed while the section was queued")
+        semaphore = ROUTE_SEMAPHORES.get(concurrency)
+        if semaphore is not None and not semaphore.acquire(timeout=max(0.0, deadline_at - started)):
+            raise RuntimeError(f"No free '{concurrency}' slot before the deadline")
+        try:
+            if name == 'database':
+                # Give up connecting by the deadline instead of holding the worker until TCP does
+                connect_timeout = min(DATABASE_CONNECT_TIMEOUT, int(deadline_at - started))
+                data = self.collect_database_info(connect_timeout=max(1, connect_timeout))
+            else:
+                data = getattr(self, collector)()
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+        return data, time.monotonic() - started
+
+class DiscardWriter:
+    """Stands in for wfile after a HEAD response's headers"""
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+def register_route(paths, handler, ttl=0, timeout=None, concurrency='light', log_sample=1.0, raw=False,
+                   vary=(), head=None):
+    """Add a route.
+
+    handler names a handler method taking the parsed query. ttl is how many
+    seconds responses may be cached, by clients and by the response cache
+    (0 = no-store); vary lists request headers the response depends on.
+    timeout bounds the wait for a concurrency slot and flags slow requests,
+    log_sample is the share of requests that get access log lines, and raw
+    routes skip query parsing and format negotiation. HEAD requests are
+    answered from the response cache or with headers only: head may name a
+    method returning the status code, and head=True runs the full handler
+    (for cheap routes whose exact headers matter).
+    """
+    if concurrency not in ROUTE_CONCURRENCY:
+        raise ValueError(f"Unknown concurrency class '{concurrency}'")
+    if isinstance(paths, str):
+        paths = (paths,)
+    for path in paths:
+        ROUTES[path] = {
+            'path': path,
+            'handler': handler,
+            'ttl': ttl,
+            'timeout': timeout or ROUTE_DEFAULT_TIMEOUT,
+            'concurrency': concurrency,
+            'log_sample': log_sample,
+            'raw': raw,
+            'vary': tuple(vary),
+            'head': head,
+        }
+
+register_route(('/_diag/',) if STATIC_DIR else ('/', '/index.html', '/_diag/'), 'send_home_page', head=True)
+# Polled by load balancers and monitors: log a sample only. Never cached:
+# it echoes the caller's address and must report draining immediately.
+register_route('/api/health', 'send_health_info', log_sample=0.1, head='health_status')
+register_route('/api/env', 'send_env_info', ttl=10)
+register_route('/api/headers', 'send_headers_info', head=True)
+register_route('/api/database', 'check_database', ttl=5, timeout=10, concurrency='database',
+               head='database_status')
+register_route('/api/system', 'send_system_info', ttl=5)
+register_route('/api/ssl-diagnostics', 'send_ssl_diagnostics', ttl=30,
+               vary=('Host', 'X-Forwarded-Proto', 'X-Forwarded-Host', 'X-Replit-Forwarded'))
+register_route('/ssl-test', 'send_ssl_test_page', head=True)
+register_route('/api/batch', 'send_batch_info', timeout=BATCH_MAX_TIMEOUT)
+register_route('/api/fleet', 'send_fleet_info', ttl=2, concurrency='io')
+register_route('/api/backups', 'send_backup_info', ttl=60, concurrency='io')
+register_route('/api/archive', 'send_archive_info', ttl=5, concurrency='io')
+register_route('/api/disk', 'send_disk_info', ttl=2, timeout=DISK_PROBE_TIME_BUDGET * 2, concurrency='io')
+register_route('/api/dns', 'send_dns_info', ttl=5, concurrency='io')
+register_route('/api/query-plans', 'send_query_plan_info', timeout=60, concurrency='database')
+register_route('/readyz', 'send_readyz', timeout=READY_DEADLINE * 2, log_sample=0.01, head='readyz_status')
+register_route('/livez', 'send_livez', log_sample=0.01, raw=True)
+register_route('/api/cache', 'send_cache_info', head=True)
+
+def response_cache_key(path, query, response_format, route, headers):
+    """Cache key for a request: everything that changes the encoded body"""
+    return (path,
+            tuple(sorted((name, tuple(values)) for name, values in query.items())),
+            response_format,
+            tuple(headers.get(name) for name in route['vary']))
+
+def lookup_cached_response(key):
+    """Return (entry, fresh) for a cached response, or (None, False).
+
+    A stale entry inside the stale window is returned as well and, unless
+    one is already running, schedules a background refresh.
+    """
+    with RESPONSE_CACHE_LOCK:
+        entry = RESPONSE_CACHE.get(key)
+        if entry is None:
+            return None, False
+        age = time.monotonic() - entry['stored']
+        ttl = entry['context']['route']['ttl']
+        if age >= ttl + RESPONSE_CACHE_STALE_SECONDS:
+            del RESPONSE_CACHE[key]
+            RESPONSE_CACHE_STATS['bytes'] -= len(entry['body'])
+            RESPONSE_CACHE_STATS['expired'] += 1
+            return None, False
+        RESPONSE_CACHE.move_to_end(key)
+        fresh = age < ttl
+        if fresh:
+            RESPONSE_CACHE_STATS['hits'] += 1
+        else:
+            RESPONSE_CACHE_STATS['stale_hits'] += 1
+            if not entry['refreshing']:
+                entry['refreshing'] = True
+                RESPONSE_CACHE_STATS['refreshes'] += 1
+                RESPONSE_CACHE_EXECUTOR.submit(refresh_cached_response, key, entry)
+    return entry, fresh
+
+def store_cached_response(key, body, response_format, context):
+    """Insert an encoded body, evicting least recently used entries over the byte budget"""
+    if len(body) > RESPONSE_CACHE_MAX_BYTES // 4:
+        # One oversized body would flush everything else
+        return
+    with RESPONSE_CACHE_LOCK:
+        previous = RESPONSE_CACHE.pop(key, None)
+        if previous is not None:
+            RESPONSE_CACHE_STATS['bytes'] -= len(previous['body'])
+        RESPONSE_CACHE[key] = {
+            'body': body,
+            'format': response_format,
+            'stored': time.monotonic(),
+            'context': context,
+            'refreshing': False,
+        }
+        RESPONSE_CACHE_STATS['bytes'] += len(body)
+        while RESPONSE_CACHE_STATS['bytes'] > RESPONSE_CACHE_MAX_BYTES:
+            _, evicted = RESPONSE_CACHE.popitem(last=False)
+            RESPONSE_CACHE_STATS['bytes'] -= len(evicted['body'])
+            RESPONSE_CACHE_STATS['evictions'] += 1
+
+def refresh_cached_response(key, entry):
+    """Re-run a stale entry's request on a detached handler to replace it"""
+    context = entry['context']
+    route = context['route']
+    # A handler that never owned a socket: headers and body go nowhere, and
+    # send_encoded_response() stores the new body under the same key
+    handler = DiagnosticHTTPRequestHandler.__new__(DiagnosticHTTPRequestHandler)
+    handler.__dict__.update(context)
+    handler.negotiate_response_format(context['query'])
+    handler.wfile = DiscardWriter()
+    handler.close_connection = True
+    handler.log_sampled = False
+    handler.cache_key = key
+    handler.cache_context = context
+    semaphore = ROUTE_SEMAPHORES.get(route['concurrency'])
+    try:
+        if semaphore is None or semaphore.acquire(timeout=route['timeout']):
+            try:
+                getattr(handler, route['handler'])(context['query'])
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+    except Exception as e:
+        logger.error(f"Response cache: refreshing {context['path']} failed: {str(e)}")
+        with RESPONSE_CACHE_LOCK:
+            RESPONSE_CACHE_STATS['refresh_failures'] += 1
+    finally:
+        # Lets a later hit retry if no fresh body replaced this entry
+        entry['refreshing'] = False
+
+def record_request_stats(elapsed, status_code):
+    """Count a finished request in REQUEST_STATS"""
+    with REQUEST_STATS_LOCK:
+        REQUEST_STATS['total'] += 1
+        REQUEST_STATS['interval_count'] += 1
+        REQUEST_STATS['interval_latency_sum'] += elapsed
+        REQUEST_STATS['interval_latency_max'] = max(REQUEST_STATS['interval_latency_max'], elapsed)
+        if status_code is None or status_code >= 500:
+            REQUEST_STATS['errors'] += 1
+            REQUEST_STATS['interval_errors'] += 1
+
+def take_request_stats():
+    """Snapshot REQUEST_STATS and start a new interval"""
+    with REQUEST_STATS_LOCK:
+        snapshot = dict(REQUEST_STATS)
+        REQUEST_STATS['interval_count'] = 0
+        REQUEST_STATS['interval_errors'] = 0
+        REQUEST_STATS['interval_latency_sum'] = 0.0
+        REQUEST_STATS['interval_latency_max'] = 0.0
+    return snapshot
+
+def register_readiness_check(name, check, timeout=1.0):
+    """Add a /readyz check.
+
+    check() returns (ok, detail) and may raise; it runs on a worker thread
+    and gets at most timeout seconds (less if the overall deadline is closer).
+    """
+    READINESS_CHECKS[name] = (check, timeout)
+
+def evaluate_readiness(refresh=False):
+    """Run the readiness checks, or reuse a verdict younger than READY_CACHE_TTL"""
+    # Draining is decided locally and must take effect immediately
+    if SERVER_LIFECYCLE['state'] == 'draining':
+        return {
+            'status': 'not_ready',
+            'reasons': ['lifecycle: server is draining'],
+            'checks': {},
+            'cached': False
+        }
+
+    with READY_LOCK:
+        now = time.monotonic()
+        if not refresh and READY_CACHE['verdict'] and now - READY_CACHE['evaluated'] < READY_CACHE_TTL:
+            return dict(READY_CACHE['verdict'], cached=True,
+                        age_seconds=round(now - READY_CACHE['evaluated'], 2))
+
+        started = time.monotonic()
+        futures = {
+            name: (READY_EXECUTOR.submit(run_readiness_check, check), timeout)
+            for name, (check, timeout) in READINESS_CHECKS.items()
+        }
+        checks = {}
+        for name, (future, timeout) in futures.items():
+            remaining = min(started + timeout, started + READY_DEADLINE) - time.monotonic()
+            try:
+                ok, detail, elapsed = future.result(timeout=max(0.0, remaining))
+                checks[name] = {'ok': ok, 'detail': detail, 'elapsed_ms': round(elapsed * 1000, 2)}
+            except FutureTimeoutError:
+                checks[name] = {
+                    'ok': False,
+                    'detail': f"timed out after {round(min(timeout, READY_DEADLINE), 2)}s",
+                    'elapsed_ms': round((time.monotonic() - started) * 1000, 2)
+                }
+
+        reasons = [f"{name}: {check['detail']}" for name, check in checks.items() if not check['ok']]
+        verdict = {
+            'status': 'not_ready' if reasons else 'ready',
+            'reasons': reasons,
+            'checks': checks,
+            'evaluated_at': datetime.datetime.now().isoformat(),
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 2)
+        }
+        READY_CACHE['verdict'] = verdict
+        READY_CACHE['evaluated'] = time.monotonic()
+        return dict(verdict, cached=False, age_seconds=0.0)
+
+def run_readiness_check(check):
+    """Call a check, turning exceptions into failures; returns (ok, detail, elapsed)"""
+    started = time.monotonic()
+    try:
+        ok, detail = check()
+    except Exception as e:
+        ok, detail = False, f"{type(e).__name__}: {str(e)}"
+    return ok, detail, time.monotonic() - started
+
+def check_database_ready():
+    """The database accepts connections and answers a trivial query"""
+    if 'DATABASE_URL' not in os.environ:
+        return True, 'skipped: DATABASE_URL not set'
+    try:
+        import psycopg2
+    except ImportError:
+        return False, 'psycopg2 is not installed'
+
+    timeout = max(1, int(READINESS_CHECKS['database'][1]))
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=timeout,
+                            options=f'-c statement_timeout={timeout * 1000}')
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    finally:
+        conn.close()
+    return True, 'connected'
+
+def check_disk_space_ready():
+    """The scratch/temp filesystem has at least READY_MIN_FREE_MB free"""
+    usage = shutil.disk_usage(DISK_PROBE_DIR)
+    free_mb = usage.free / (1024 * 1024)
+    if free_mb < READY_MIN_FREE_MB:
+        return False, f"only {free_mb:.0f} MB free on {DISK_PROBE_DIR} (minimum {READY_MIN_FREE_MB:.0f} MB)"
+    return True, f"{free_mb:.0f} MB free on {DISK_PROBE_DIR}"
+
+def check_upstream_ready():
+    """READY_UPSTREAM_URL answers with a non-error status"""
+    if not READY_UPSTREAM_URL:
+        return True, 'skipped: READY_UPSTREAM_URL not set'
+    parsed = urlparse(READY_UPSTREAM_URL)
+    timeout = READINESS_CHECKS['upstream_app'][1]
+    connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    conn = connection_class(parsed.hostname, parsed.port, timeout=timeout)
+    try:
+        conn.request('GET', (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else ''))
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    if response.status >= 400:
+        return False, f"{READY_UPSTREAM_URL} returned HTTP {response.status}"
+    return True, f"HTTP {response.status}"
+
+register_readiness_check('database', check_database_ready, timeout=2.0)
+register_readiness_check('disk_space', check_disk_space_ready, timeout=0.5)
+register_readiness_check('upstream_app', check_upstream_ready, timeout=1.5)
+
+def get_host_facts():
+    """Platform, Python and Node.js facts, gathered once and then cached.
+
+    platform.processor() and `node --version` start subprocesses, so these
+    are kept out of startup and out of every /api/health request.
+    """
+    with HOST_FACTS_LOCK:
+        if not HOST_FACTS:
+            import platform
+            import subprocess
+            node_version = "Not installed"
+            try:
+                node_version = subprocess.check_output(['node', '--version'], timeout=5).decode('utf-8').strip()
+            except:
+                pass
+            HOST_FACTS.update({
+                'system': platform.system(),
+                'node': platform.node(),
+                'release': platform.release(),
+                'version': platform.version(),
+                'machine': platform.machine(),
+                'processor': platform.processor(),
+                'architecture': platform.architecture(),
+                'platform': platform.platform(),
+                'python_version': platform.python_version(),
+                'python_implementation': platform.python_implementation(),
+                'node_version': node_version,
+            })
+        return HOST_FACTS
+
+def collect_archive_sample(httpd):
+    """Build one archive record from the current process and request state"""
+    now = time.time()
+    try:
+        load = os.getloadavg()
+    except OSError:
+        load = (0.0, 0.0, 0.0)
+
+    meminfo = {}
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if parts[0] in ('MemTotal:', 'MemAvailable:'):
+                    meminfo[parts[0]] = int(parts[1])
+    except (OSError, ValueError, IndexError):
+        pass
+
+    stats = take_request_stats()
+    latency_avg = stats['interval_latency_sum'] / stats['interval_count'] if stats['interval_count'] else 0.0
+    db_status = DB_STATUS['status']
+    state = SERVER_LIFECYCLE['state']
+
+    return (
+        now,
+        os.getpid(),
+        now - SERVER_START_TIME,
+        load[0], load[1], load[2],
+        meminfo.get('MemTotal:', 0),
+        meminfo.get('MemAvailable:', 0),
+        stats['total'],
+        stats['errors'],
+        stats['interval_count'],
+        stats['interval_errors'],
+        latency_avg * 1000,
+        stats['interval_latency_max'] * 1000,
+        httpd.inflight,
+        ARCHIVE_DB_STATUSES.index(db_status) if db_status in ARCHIVE_DB_STATUSES else 0,
+        ARCHIVE_STATES.index(state) if state in ARCHIVE_STATES else 0
+    )
+
+def run_archive_sampler(archive, httpd, stop_event):
+    """Background loop appending a sample every ARCHIVE_INTERVAL seconds"""
+    archive.compact()
+    while not stop_event.wait(ARCHIVE_INTERVAL):
+        try:
+            archive.append(collect_archive_sample(httpd))
+        except Exception as e:
+            logger.error(f"Metrics archive: sample failed: {str(e)}")
+
+class DiagnosticHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server that counts in-flight requests so it can drain"""
+    daemon_threads = True
+    # listen() backlog; the default of 5 drops SYNs during any accept pause
+    request_queue_size = 128
+    # Draining is bounded by wait_for_requests() instead of joining threads
+    block_on_close = False
+
+    def server_bind(self):
+        # HTTPServer.server_bind() sets server_name with socket.getfqdn(),
+        # which can stall startup for seconds when reverse DNS is broken
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address[:2]
+
+    def __init__(self, server_address, handler_class, listen_fd=None):
+        self.inflight = 0
+        self.inflight_condition = threading.Condition()
+        # Kept-alive connections waiting for their next request; not in flight
+        self.idle_connections = set()
+        if listen_fd is None:
+            super().__init__(server_address, handler_class)
+            return
+
+        # Adopt the listening socket inherited across a re-exec instead of
+        # binding, so the port never stops accepting connections
+        super().__init__(server_address, handler_class, bind_and_activate=False)
+        self.socket.close()
+        self.socket = socket.socket(fileno=listen_fd)
+        self.server_address = self.socket.getsockname()[:2]
+        self.server_name, self.server_port = self.server_address
+
+    def process_request(self, request, client_address):
+        with self.inflight_condition:
+            self.inflight += 1
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.finish_inflight()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.inflight_condition:
+                if request in self.idle_connections:
+                    self.idle_connections.discard(request)
+                else:
+                    self.finish_inflight()
+
+    def connection_idle(self, request):
+        """A kept-alive connection finished a request and waits for the next"""
+        with self.inflight_condition:
+            if request not in self.idle_connections:
+                self.idle_connections.add(request)
+                self.finish_inflight()
+
+    def connection_busy(self, request):
+        """An idle kept-alive connection received its next request"""
+        with self.inflight_condition:
+            if request in self.idle_connections:
+                self.idle_connections.discard(request)
+                self.inflight += 1
+
+    def finish_inflight(self):
+        with self.inflight_condition:
+            self.inflight -= 1
+            if self.inflight == 0:
+                self.inflight_condition.notify_all()
+
+    def wait_for_requests(self, timeout):
+        """Wait for in-flight requests to finish; False if the deadline passed"""
+        with self.inflight_condition:
+            return self.inflight_condition.wait_for(lambda: self.inflight == 0, timeout)
+
+def set_lifecycle_state(state):
+    """Record a lifecycle transition"""
+    SERVER_LIFECYCLE['state'] = state
+    SERVER_LIFECYCLE['since'] = datetime.datetime.now().isoformat()
+
+def install_signal_handlers(httpd):
+    """SIGTERM drains and exits; SIGHUP re-execs without closing the port"""
+    def graceful_stop(grace_seconds):
+        # Runs in its own thread: shutdown() blocks until serve_forever()
+        # has returned, which would deadlock inside the signal handler
+        if grace_seconds > 0:
+            logger.info(f"Draining: still accepting for {grace_seconds}s while health reports 'draining'")
+            time.sleep(grace_seconds)
+        httpd.shutdown()
+
+    def handoff_and_stop():
+        # The standby accepts on the shared socket from here on, so this
+        # process can stop accepting and drain for as long as it needs
+        SERVER_LIFECYCLE['handoff_pid'] = start_standby_server(httpd)
+        httpd.shutdown()
+
+    def handle_sigterm(signum, frame):
+        if SERVER_LIFECYCLE['state'] == 'draining':
+            return
+        logger.info("SIGTERM received, starting graceful shutdown")
+        set_lifecycle_state('draining')
+        # A standby only bridges a restart: the restarted server is already
+        # accepting, so there is nothing to keep load balancers away from
+        grace_seconds = 0 if SERVER_LIFECYCLE['standby'] else DRAIN_GRACE_SECONDS
+        threading.Thread(target=graceful_stop, args=(grace_seconds,), daemon=True).start()
+
+    def handle_sighup(signum, frame):
+        if SERVER_LIFECYCLE['state'] == 'draining' or SERVER_LIFECYCLE['standby']:
+            return
+        logger.info("SIGHUP received, handing the listening socket to a standby and restarting")
+        SERVER_LIFECYCLE['restart_requested'] = True
+        set_lifecycle_state('draining')
+        threading.Thread(target=handoff_and_stop, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGHUP, handle_sighup)
+
+def start_standby_server(httpd):
+    """Start a copy of the server on the listening socket and wait until it accepts.
+
+    Returns the standby's pid, or None if it could not be started in time;
+    the restart then relies on the listen backlog alone.
+    """
+    import select
+    import subprocess
+    listen_fd = httpd.socket.fileno()
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ)
+    env[LISTEN_FD_ENV] = str(listen_fd)
+    env[HANDOFF_READY_ENV] = str(write_fd)
+    env.pop(HANDOFF_PID_ENV, None)
+    try:
+        standby = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(listen_fd, write_fd))
+    except OSError as e:
+        logger.error(f"Could not start a standby server: {str(e)}")
+        os.close(read_fd)
+        return None
+    finally:
+        os.close(write_fd)
+
+    try:
+        ready, _, _ = select.select([read_fd], [], [], HANDOFF_READY_TIMEOUT)
+        accepted = bool(ready) and os.read(read_fd, 1) == b'1'
+    finally:
+        os.close(read_fd)
+    if not accepted:
+        logger.warning(f"Standby server {standby.pid} did not become ready; "
+                       f"connections wait in the backlog during the restart")
+        standby.kill()
+        standby.wait()
+        return None
+    logger.info(f"Standby server {standby.pid} is accepting; draining this process")
+    return standby.pid
+
+def retire_standby(pid):
+    """Stop the standby that covered a restart and reap it"""
+    try:
+        os.kill(pid, signal.SIGTERM)
+        # exec() keeps children, so the standby is still ours to reap
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+    logger.info(f"Standby server {pid} has been retired")
+
+def write_pid_file():
+    """Record this server's pid and a stamp that changes on every (re)start"""
+    try:
+        with open(PID_FILE, 'w') as f:
+            f.write(f"{os.getpid()}\n{time.time()}\n")
+    except OSError as e:
+        logger.warning(f"Could not write pid file {PID_FILE}: {str(e)}")
+
+def remove_pid_file():
+    """Remove the pid file if it still names this process"""
+    try:
+        with open(PID_FILE, 'r') as f:
+            if f.readline().strip() == str(os.getpid()):
+                os.unlink(PID_FILE)
+    except OSError:
+        pass
+
+def reexec_server(httpd):
+    """Replace this process with a fresh copy that inherits the listening socket"""
+    listen_fd = httpd.socket.fileno()
+    os.set_inheritable(listen_fd, True)
+    os.environ[LISTEN_FD_ENV] = str(listen_fd)
+    if SERVER_LIFECYCLE['handoff_pid'] is not None:
+        os.environ[HANDOFF_PID_ENV] = str(SERVER_LIFECYCLE['handoff_pid'])
+    logger.info(f"Re-executing {sys.executable} {' '.join(sys.argv)} (listening fd {listen_fd})")
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+def process_start_time():
+    """perf_counter() value at which this process started, or None.
+
+    Linux only, and only as precise as the kernel's clock ticks (~10 ms).
+    None after a re-exec, whose timing then starts at MODULE_START.
+    """
+    if REEXECUTED:
+        return None
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # Fields after the command name; starttime is field 22 of stat(5)
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    return time.perf_counter() - age
+
+def mark_startup_phase(name, started):
+    """Record a startup phase that began at perf_counter() value started"""
+    now = time.perf_counter()
+    STARTUP_PHASES[name] = round((now - started) * 1000, 1)
+    return now
+
+def log_startup_timing():
+    """Log how long each startup phase took, up to listening"""
+    process_start = process_start_time()
+    STARTUP_STATE['process_start'] = process_start
+    phases = OrderedDict()
+    if process_start is not None:
+        # Interpreter startup plus compiling this file
+        phases['interpreter'] = round((MODULE_START - process_start) * 1000, 1)
+    phases['imports'] = round((IMPORTS_DONE - MODULE_START) * 1000, 1)
+    phases.update(STARTUP_PHASES)
+    STARTUP_PHASES.clear()
+    STARTUP_PHASES.update(phases)
+    listening = (time.perf_counter() - (process_start or MODULE_START)) * 1000
+    logger.info(f"Startup timing{' (fast start)' if FAST_START else ''}{' (re-exec)' if REEXECUTED else ''}: "
+                f"{', '.join(f'{name} {ms:.1f} ms' for name, ms in phases.items())}; "
+                f"listening after {listening:.1f} ms")
+
+def log_first_response(command, path, status):
+    """Log time-to-first-response, the number fast start is meant to minimize"""
+    elapsed = (time.perf_counter() - (STARTUP_STATE['process_start'] or MODULE_START)) * 1000
+    STARTUP_STATE['first_response_ms'] = round(elapsed, 1)
+    logger.info(f"First response ({command} {path} -> {status}) {elapsed:.1f} ms after {'re-exec' if REEXECUTED else 'process start'}")
+
+def log_startup_facts():
+    """Log the Python/platform details, database and environment configuration"""
+    import platform
+    logger.info(f"Starting diagnostic server (Python {platform.python_version()})")
+    logger.info(f"Hostname: {socket.gethostname()}")
+    logger.info(f"Platform: {platform.platform()}")
     
-    parts = []
-    if days > 0:
-        parts.append(f"{int(days)}d")
-    if hours > 0:
-        parts.append(f"{int(hours)}h")
-    if minutes > 0:
-        parts.append(f"{int(minutes)}m")
-    parts.append(f"{int(seconds)}s")
+    # Detect environment
+    if 'REPL_ID' in os.environ:
+        logger.info(f"Running in Replit environment (REPL_ID: {os.environ.get('REPL_ID')})")
+        logger.info(f"REPL_SLUG: {os.environ.get('REPL_SLUG', 'Not set')}")
+        logger.info(f"REPL_OWNER: {os.environ.get('REPL_OWNER', 'Not set')}")
     
-    return " ".join(parts)
+    # Check database connection at startup
+    if 'DATABASE_URL' in os.environ:
+        logger.info("Database URL is configured in environment variables")
+        # Sanitize the URL for logging (hide password)
+        db_url = os.environ.get('DATABASE_URL', '')
+        if '://' in db_url and '@' in db_url:
+            prefix = db_url.split('://')[0]
+            credentials = db_url.split('://')[1].split('@')[0]
+            if ':' in credentials:
+                username = credentials.split(':')[0]
+                rest = db_url.split('@')[1]
+                sanitized_url = f"{prefix}://{username}:****@{rest}"
+                logger.info(f"Database connection string format: {sanitized_url}")
+    else:
+        logger.warning("Database URL is not configured in environment variables")
+    
+    if STATIC_DIR:
+        if os.path.isdir(STATIC_DIR):
+            logger.info(f"Static file mode: serving {STATIC_DIR} (diagnostic home at {DIAG_HOME_PATH})")
+        else:
+            logger.warning(f"Static file mode: {STATIC_DIR} is not a directory")
+    
+    # Log available environment variables for debugging
+    env_vars = []
+    for key in sorted(os.environ.keys()):
+        if key.startswith(('REPL_', 'PORT', 'PATH', 'DATABASE_', 'NODE_')):
+            # Don't log sensitive values
+            if 'URL' in key or 'TOKEN' in key or 'KEY' in key or 'SECRET' in key or 'PASS' in key:
+                env_vars.append(f"{key}=<hidden>")
+            else:
+                env_vars.append(f"{key}={os.environ[key]}")
+    logger.info(f"Environment variables: {', '.join(env_vars)}")
+
+def warm_up():
+    """FAST_START background work: everything startup skipped before binding"""
+    started = time.perf_counter()
+    try:
+        log_startup_facts()
+        get_host_facts()
+        # Modules the first diagnostic requests would otherwise import
+        import importlib
+        for name in ('hashlib', 'statistics'):
+            importlib.import_module(name)
+    except Exception as e:
+        logger.error(f"Warm-up failed: {str(e)}")
+    logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.1f} ms")
 
 def run_server(port=5000):
     """Start the HTTP server"""
+    phase_start = time.perf_counter()
     server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, DiagnosticHTTPRequestHandler)
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+    ready_fd = os.environ.pop(HANDOFF_READY_ENV, None)
+    retire_pid = os.environ.pop(HANDOFF_PID_ENV, None)
+    standby = SERVER_LIFECYCLE['standby'] = ready_fd is not None
+    if listen_fd is not None:
+        httpd = DiagnosticHTTPServer(server_address, DiagnosticHTTPRequestHandler, listen_fd=int(listen_fd))
+        logger.info(f"{'Standby accepting' if standby else 'Resuming diagnostic server'} on inherited socket "
+                    f"{httpd.server_address[0]}:{httpd.server_address[1]}")
+    else:
+        httpd = DiagnosticHTTPServer(server_address, DiagnosticHTTPRequestHandler)
+        logger.info(f"Starting diagnostic server on http://0.0.0.0:{port}/")
+    phase_start = mark_startup_phase('bind', phase_start)
+    install_signal_handlers(httpd)
+    # Start resolving the FQDN now so the first /api/system has it
+    get_host_identity()
+    if not standby:
+        write_pid_file()
+    # The capture file, metrics archive and query-plan schedule belong to the
+    # main server; a standby writing them too would interleave or corrupt them
+    if CAPTURE_FILE and not standby:
+        enable_traffic_capture(CAPTURE_FILE)
+        logger.info(f"Capturing requests to {CAPTURE_FILE} (rotating at {CAPTURE_MAX_BYTES} bytes)")
+    
+    global METRICS_ARCHIVE
+    archive_stop = threading.Event()
+    if ARCHIVE_DIR and not standby:
+        try:
+            METRICS_ARCHIVE = MetricsArchive(ARCHIVE_DIR)
+            threading.Thread(target=run_archive_sampler, args=(METRICS_ARCHIVE, httpd, archive_stop),
+                             name='metrics-archive', daemon=True).start()
+            logger.info(f"Metrics archive: sampling every {ARCHIVE_INTERVAL}s into {ARCHIVE_DIR}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Metrics archive disabled: {str(e)}")
+            METRICS_ARCHIVE = None
+    
+    query_plan_stop = threading.Event()
+    if QUERY_PLAN_INTERVAL > 0 and 'DATABASE_URL' in os.environ and not standby:
+        threading.Thread(target=run_query_plan_scheduler, args=(query_plan_stop,),
+                         name='query-plans', daemon=True).start()
+        logger.info(f"Query plans: checking every {QUERY_PLAN_INTERVAL}s (baseline {QUERY_PLAN_BASELINE_FILE})")
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    if ('DATABASE_URL' in os.environ and not standby
+            and os.path.commonpath([os.path.realpath(QUERY_PLAN_BASELINE_FILE), temp_dir]) == temp_dir):
+        logger.warning(f"Query plans: baseline {QUERY_PLAN_BASELINE_FILE} is in the temp directory; "
+                       f"plans recorded there may not survive a reboot (set QUERY_PLAN_BASELINE)")
+    
+    mark_startup_phase('services', phase_start)
+    log_startup_timing()
+    if FAST_START:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
     
-    logger.info(f"Starting diagnostic server on http://0.0.0.0:{port}/")
-    logger.info("Press Ctrl+C to stop the server")
+    logger.info("Press Ctrl+C to stop the server (SIGTERM drains, SIGHUP restarts in place)")
+    if ready_fd is not None:
+        # The socket is already listening; tell the restarting server it can stop accepting
+        os.write(int(ready_fd), b'1')
+        os.close(int(ready_fd))
+    if retire_pid is not None:
+        threading.Thread(target=retire_standby, args=(int(retire_pid),), name='retire-standby',
+                         daemon=True).start()
     
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         logger.info("Server shutdown requested")
+        set_lifecycle_state('draining')
     finally:
+        # serve_forever() has stopped accepting. Unless the socket is being
+        # handed to a re-exec, close it so new connections fail fast rather
+        # than queueing behind the drain.
+        if not SERVER_LIFECYCLE['restart_requested']:
+            httpd.socket.close()
+        # Let in-flight requests finish
+        if httpd.inflight:
+            logger.info(f"Waiting up to {DRAIN_TIMEOUT_SECONDS}s for {httpd.inflight} in-flight request(s)")
+        if not httpd.wait_for_requests(DRAIN_TIMEOUT_SECONDS):
+            logger.warning(f"Drain deadline passed with {httpd.inflight} request(s) still in flight")
+        query_plan_stop.set()
+        if METRICS_ARCHIVE is not None:
+            # Record the final state so the archive covers the shutdown itself
+            archive_stop.set()
+            try:
+                METRICS_ARCHIVE.append(collect_archive_sample(httpd))
+            except Exception as e:
+                logger.error(f"Metrics archive: final sample failed: {str(e)}")
+            METRICS_ARCHIVE.close()
+        if SERVER_LIFECYCLE['restart_requested']:
+            try:
+                reexec_server(httpd)
+            except OSError as e:
+                logger.error(f"Re-exec failed, shutting down instead: {str(e)}")
+                if SERVER_LIFECYCLE['handoff_pid'] is not None:
+                    logger.error(f"Standby server {SERVER_LIFECYCLE['handoff_pid']} keeps serving the port")
+        if not standby:
+            remove_pid_file()
         httpd.server_close()
         logger.info("Server has been stopped")
 
+# Command line modes: python3 simple-server.py <command> [options]
+CLI_COMMANDS = {
+    'inspect-backup': inspect_backup_cli,
+    'replay': replay_cli,
+    'query-plans': query_plans_cli,
+    'seed-db': seed_db_cli,
+}
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
+
     try:
+        main_start = time.perf_counter()
+        STARTUP_PHASES['module setup'] = round((main_start - IMPORTS_DONE) * 1000, 1)
+        
         # Get port from environment variable or use default
         port = int(os.environ.get('PORT', 5000))
         
-        # Additional startup checks
-        logger.info(f"Starting diagnostic server (Python {platform.python_version()})")
-        logger.info(f"Hostname: {socket.gethostname()}")
-        logger.info(f"Platform: {platform.platform()}")
-        
-        # Detect environment
-        if 'REPL_ID' in os.environ:
-            logger.info(f"Running in Replit environment (REPL_ID: {os.environ.get('REPL_ID')})")
-            logger.info(f"REPL_SLUG: {os.environ.get('REPL_SLUG', 'Not set')}")
-            logger.info(f"REPL_OWNER: {os.environ.get('REPL_OWNER', 'Not set')}")
-        
-        # Check database connection at startup
-        if 'DATABASE_URL' in os.environ:
-            logger.info("Database URL is configured in environment variables")
-            # Sanitize the URL for logging (hide password)
-            db_url = os.environ.get('DATABASE_URL', '')
-            if '://' in db_url and '@' in db_url:
-                prefix = db_url.split('://')[0]
-                credentials = db_url.split('://')[1].split('@')[0]
-                if ':' in credentials:
-                    username = credentials.split(':')[0]
-                    rest = db_url.split('@')[1]
-                    sanitized_url = f"{prefix}://{username}:****@{rest}"
-                    logger.info(f"Database connection string format: {sanitized_url}")
-        else:
-            logger.warning("Database URL is not configured in environment variables")
-        
-        # Log available environment variables for debugging
-        env_vars = []
-        for key in sorted(os.environ.keys()):
-            if key.startswith(('REPL_', 'PORT', 'PATH', 'DATABASE_', 'NODE_')):
-                # Don't log sensitive values
-                if 'URL' in key or 'TOKEN' in key or 'KEY' in key or 'SECRET' in key or 'PASS' in key:
-                    env_vars.append(f"{key}=<hidden>")
-                else:
-                    env_vars.append(f"{key}={os.environ[key]}")
-        logger.info(f"Environment variables: {', '.join(env_vars)}")
+        # Additional startup checks; fast start logs these after binding
+        if not FAST_START:
+            log_startup_facts()
+            mark_startup_phase('startup facts', main_start)
         
         # Run the server, handling keyboard interrupts
         try:
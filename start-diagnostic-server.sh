@@ -1,10 +1,66 @@
 #!/bin/bash
 
-# Check if Python is already running
-if pgrep -f "python.*simple-server.py" > /dev/null; then
-    echo "Server is already running. Restarting..."
-    pkill -f "python.*simple-server.py"
-    sleep 1
+PORT="${PORT:-5000}"
+# Written by simple-server.py as "<pid>\n<start stamp>"; the replay,
+# inspect-backup, query-plans and seed-db commands never write it
+PID_FILE="${DIAG_PID_FILE:-${TMPDIR:-/tmp}/diagnostic-server-$PORT.pid}"
+
+livez_ok() {
+    if command -v curl > /dev/null; then
+        curl -fsS -m 2 "http://127.0.0.1:$PORT/livez" > /dev/null 2>&1
+    else
+        python3 -c "import urllib.request; urllib.request.urlopen('http://127.0.0.1:$PORT/livez', timeout=2)" > /dev/null 2>&1
+    fi
+}
+
+server_pids() {
+    if [ -f "$PID_FILE" ]; then
+        head -n 1 "$PID_FILE"
+    fi
+    # Servers started before the pid file existed. Only the bare server
+    # command line matches, never `simple-server.py <command> ...`
+    pgrep -f "python[0-9.]* ([^ ]*/)?simple-server\.py$"
+}
+
+# Restart in place: SIGHUP makes the server start a standby on the same
+# listening socket, drain, and re-exec itself. The re-exec'd server
+# rewrites the pid file, so a new stamp plus a live /livez means it worked.
+if [ -f "$PID_FILE" ] && kill -0 "$(head -n 1 "$PID_FILE")" 2> /dev/null; then
+    pid=$(head -n 1 "$PID_FILE")
+    stamp=$(cat "$PID_FILE")
+    echo "Server is already running (pid $pid). Restarting in place..."
+    kill -HUP "$pid"
+    # Allow for the drain (DRAIN_TIMEOUT_SECONDS, 25s by default) plus startup
+    drain="${DRAIN_TIMEOUT_SECONDS:-25}"
+    attempts=$(( (${drain%%.*} + 10) * 5 ))
+    for _ in $(seq 1 "$attempts"); do
+        sleep 0.2
+        if ! kill -0 "$pid" 2> /dev/null; then
+            echo "Server exited instead of restarting"
+            break
+        fi
+        if [ "$(cat "$PID_FILE" 2> /dev/null)" != "$stamp" ] && livez_ok; then
+            echo "Server restarted in place"
+            exit 0
+        fi
+    done
+    echo "In-place restart did not complete; falling back to a full restart"
+fi
+
+pids=$(server_pids | sort -u)
+if [ -n "$pids" ]; then
+    echo "Stopping running server (pid $(echo $pids))..."
+    kill $pids 2> /dev/null
+    # SIGTERM drains: DRAIN_GRACE_SECONDS + DRAIN_TIMEOUT_SECONDS at most
+    for _ in $(seq 1 175); do
+        alive=""
+        for pid in $pids; do
+            kill -0 "$pid" 2> /dev/null && alive="$alive $pid"
+        done
+        [ -z "$alive" ] && break
+        sleep 0.2
+    done
+    [ -n "$alive" ] && kill -9 $alive 2> /dev/null
 fi
 
 # Make sure Python script is executable
@@ -23,4 +79,4 @@ elif command -v python > /dev/null; then
 else
     echo "ERROR: No Python interpreter found!"
     exit 1
-fi
\ No newline at end of file
+fi